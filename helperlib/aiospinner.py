@@ -0,0 +1,160 @@
+#  vim: set ts=8 sw=4 tw=0 fileencoding=utf-8 filetype=python expandtab:
+"""
+asyncio variant of helperlib.spinner
+
+The animation is driven by the event loop (loop.call_later), so no
+thread is started and stopping never has to wait for a tick:
+
+    >>> async with waitfor('Fetching') as spinner:
+    ...     spinner.status('page 1')
+    ...     await fetch()
+"""
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import random
+import sys
+import time
+from collections import deque
+
+from .terminal import TerminalController
+from .spinner import _SPINNERS, _progress_info, _log_timing
+
+__all__ = ['Spinner', 'waitfor']
+
+
+class Spinner(object):
+    """
+    Spinner which is animated by the running event loop
+
+    Provides the same status/status_append/progress/succeeded/failed
+    API as helperlib.spinner. Used as async context manager it succeeds
+    on exit or fails if an exception was raised.
+
+    Arguments:
+        message  - message shown next to the spinner
+        stream   - output stream (default sys.stderr), only animated if
+                   it is a terminal. Only the markers are coloured, the
+                   message and status are written as they are.
+        interval - seconds between frames (default 0.1)
+        timing   - log the duration of every status (phase) when done
+    """
+
+    def __init__(self, message, stream=None, interval=0.1, timing=False):
+        self.message = message
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.tty = self.stream.isatty()
+        self.term = TerminalController(self.stream)
+        self.spinner = random.choice(_SPINNERS)
+        self.i = 0
+        self.finished = False
+        self._status = ''
+        self._progress = None
+        self._samples = deque()
+        self._dirty = False
+        self._handle = None
+        self._phases = [('', time.time())] if timing else None
+
+    def _marker(self):
+        return self.term.bind("[${BOLD}${BLUE}%s${NORMAL}]" % (
+            self.spinner[self.i],))
+
+    def _write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+
+    def _line(self, marker, status):
+        s = marker + ' ' + self.message
+        if status:
+            s += ': ' + status.replace('\n', ' ')
+        return s
+
+    def _current_status(self):
+        status = self._status
+        if self._progress is not None:
+            info = _progress_info(self._progress, self._samples, time.time())
+            status = status + ' ' + info if status else info
+        return status
+
+    def _draw(self):
+        self._write('\x1b[J ' +
+                    self._line(self._marker(), self._current_status()) +
+                    '\x1b[G')
+
+    def _tick(self, loop):
+        self.i = (self.i + 1) % len(self.spinner)
+        if self._dirty or self._progress is not None:
+            self._dirty = False
+            self._draw()
+        else:
+            self._write('\x1b[s ' + self._marker() + '\x1b[u')
+        self._handle = loop.call_later(self.interval, self._tick, loop)
+
+    def start(self):
+        """
+        Starts the animation, has to be called from the event loop
+        """
+        if self.tty:
+            loop = asyncio.get_running_loop()
+            self._draw()
+            self._handle = loop.call_later(self.interval, self._tick, loop)
+        else:
+            self._write(self.message + '\n')
+
+    def status(self, s):
+        self._status = s
+        if self._phases is not None:
+            self._phases.append((s, time.time()))
+        self._dirty = True
+
+    def status_append(self, s):
+        self._status += s
+        self._dirty = True
+
+    def progress(self, done, total=None, unit=''):
+        """
+        Reports numeric progress, shown with rate and ETA at the next frame
+        """
+        self._progress = (done, total, unit)
+
+    def _stop(self, marker, status):
+        if self.finished:
+            return
+        self.finished = True
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        marker = self.term.bind(marker)
+        if self.tty:
+            self._write('\x1b[K' + self._line(marker, status) + '\n\x1b[?25h')
+        else:
+            self._write(self._line(marker, status) + '\n')
+        if self._phases is not None:
+            _log_timing(self.message, self._phases, status)
+
+    def succeeded(self, s='Done'):
+        self._stop('[${BOLD}${GREEN}+${NORMAL}]', s)
+
+    def failed(self, s='FAILED!'):
+        self._stop('[${BOLD}${RED}-${NORMAL}]', s)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.succeeded()
+        elif issubclass(exc_type, asyncio.CancelledError):
+            self.failed('cancelled')
+        else:
+            self.failed()
+        return False
+
+
+def waitfor(message, **kwargs):
+    """
+    Returns a Spinner for message to be used with `async with`
+    """
+    return Spinner(message, **kwargs)
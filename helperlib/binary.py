@@ -3,9 +3,15 @@ from __future__ import absolute_import, print_function, unicode_literals
 import sys
 import struct
 import io
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import islice
+from operator import itemgetter
 from string import punctuation, digits, ascii_letters
 
 import six
+import re
+import keyword
 
 from .internal import TERM
 
@@ -176,18 +182,138 @@ def hexdump(data, cols=8, folded=False, stream=False, offset=0, header=False):
             yield line.rstrip()
 
 
+def _record_fields(struct_type, start, end):
+    """
+    returns the paths of all fields covering the range [start, end) of
+    an array of struct_type records
+    """
+    size = struct_type.struct_size
+    paths = []
+    while start < end and size:
+        record, offset = divmod(start, size)
+        stop = min(size, offset + end - start)
+        paths.extend(field.path
+                     for field in struct_type.fields_in_range(offset, stop))
+        start += stop - offset
+    return paths
+
+
+_PALETTE = ('GREEN', 'YELLOW', 'MAGENTA', 'CYAN', 'RED', 'BLUE')
+_FIELD_MASKS = {}
+_ROW_SEGMENTS = {}
+
+
+def _field_mask(struct_type):
+    """
+    returns the (cached) palette index of every byte of struct_type,
+    None for bytes not covered by a field
+    """
+    try:
+        return _FIELD_MASKS[struct_type]
+    except KeyError:
+        pass
+    mask = [None] * struct_type.struct_size
+    for i, field in enumerate(struct_type._offset_table_):
+        mask[field.offset:field.offset + field.size] = \
+            [i % len(_PALETTE)] * field.size
+    _FIELD_MASKS[struct_type] = mask
+    return mask
+
+
+def _row_segments(struct_type, cols, phase, dim):
+    """
+    returns the (cached) colour runs of a row starting at byte phase of
+    a record as list of (first column, last column + 1, escape sequence)
+    """
+    key = (struct_type, cols, phase, dim)
+    try:
+        return _ROW_SEGMENTS[key]
+    except KeyError:
+        pass
+    mask = _field_mask(struct_type)
+    runs = []
+    for col in range(cols):
+        colour = mask[(phase + col) % len(mask)] if mask else None
+        if runs and runs[-1][2] == colour:
+            runs[-1][1] = col + 1
+        else:
+            runs.append([col, col + 1, colour])
+    segments = _ROW_SEGMENTS[key] = [
+        (first, last, TERM.render(
+            '${NORMAL}' + dim if colour is None
+            else dim + '${' + _PALETTE[colour] + '}'))
+        for first, last, colour in runs
+    ]
+    return segments
+
+
+def _legend(struct_type, dim):
+    return ' '.join(
+        TERM.render(dim + '${' + _PALETTE[i % len(_PALETTE)] + '}') +
+        field.path
+        for i, field in enumerate(struct_type._offset_table_)
+    ) + TERM.render('${NORMAL}')
+
+
 def print_hexdump(data, colored=False, cols=16, file=sys.stdout, header=False, bright=False, *args, **kwargs):
+    """
+    prints a hex dump of data (see hexdump)
+
+    If struct_type (a binary.Structure class) is given, data is treated
+    as array of these records and each row is annotated with the names
+    of the fields it covers. Colored output additionally colours the
+    bytes by field and starts with a legend.
+    """
+    struct_type = kwargs.pop('struct_type', None)
     first = header
     dim = '${DIM}' if bright else ''
+    base = kwargs.get('offset', 0)
+    size = None if kwargs.get('stream') else len(data)
+    lines = []
+    if colored and struct_type is not None:
+        lines.append(_legend(struct_type, dim))
     for row in hexdump(data, cols, header=header, *args, **kwargs):
+        annotation = ''
+        idx = row.find(':') + 1
+        if struct_type is not None and idx:
+            start = int(row[:idx - 1], 16) - base
+            end = start + cols
+            if size is not None:
+                end = min(end, size)
+            annotation = ' ' * (3 * cols + cols - len(row) + idx + 2) + \
+                ', '.join(_record_fields(struct_type, max(start, 0), end))
         if colored:
             if first:
                 row = TERM.render(dim + "${CYAN}" + row + "${NORMAL}")
                 first = False
+            elif struct_type is not None and idx and struct_type.struct_size:
+                cells = row[idx + 1:idx + 1 + 3 * cols]
+                string = row[idx + 1 + 3 * cols:]
+                # only colour the columns holding bytes, not the padding
+                lo = (len(cells) - len(cells.lstrip(' '))) // 3
+                hi = (len(cells.rstrip(' ')) + 1) // 3
+                segments = [
+                    (max(i, lo), min(j, hi), colour)
+                    for i, j, colour in _row_segments(
+                        struct_type, cols, start % struct_type.struct_size,
+                        dim)
+                    if i < hi and j > lo
+                ]
+                row = ''.join(
+                    [TERM.render(dim + "${CYAN}") + row[:idx + 1] +
+                     cells[:3 * lo]] +
+                    [colour + cells[3 * i:3 * j] for i, j, colour in segments] +
+                    [cells[3 * hi:] + string[:lo]] +
+                    [colour + string[i:j] for i, j, colour in segments] +
+                    [string[hi:] + TERM.render("${NORMAL}")])
             else:
-                idx = row.find(':') + 1
                 row = TERM.render(dim + "${CYAN}" + row[:idx] + "${YELLOW}" + row[idx:idx+3*cols] + "${BLUE}") + row[idx+3*cols:] + TERM.render("${NORMAL}")
-        print(row, file=file)
+        lines.append(row + annotation.rstrip())
+        if len(lines) >= 1024:
+            file.write('\n'.join(lines) + '\n')
+            lines = []
+    if lines:
+        file.write('\n'.join(lines) + '\n')
 
 
 def hexII(data, cols=8, folded=False, stream=False, offset=0, header=True):
@@ -415,7 +541,107 @@ def parse_hexII(data):
     return out.getvalue()
 
 
-def print_struct(struct, ident=0):
+#: position of a (possibly nested) field inside a structure
+FieldInfo = namedtuple('FieldInfo', 'offset size path descriptor')
+
+
+_VALUE, _ARRAY, _STRUCT = range(3)
+_STRUCT_KINDS = {}
+_SKIP = object()
+
+
+def _struct_kind(cls):
+    """
+    returns the (cached) kind of values of type cls and the field names
+    for structures
+    """
+    try:
+        return _STRUCT_KINDS[cls]
+    except KeyError:
+        pass
+
+    if issubclass(cls, (six.text_type, bytes, list, tuple)):
+        kind = _VALUE, None
+    elif hasattr(cls, '__getitem__'):
+        kind = _ARRAY, None
+    elif isinstance(cls, StructureMeta):
+        kind = _STRUCT, tuple(cls._field_names_)
+    elif hasattr(cls, '_fields_'):
+        kind = _STRUCT, tuple(field[0] for field in cls._fields_)
+    else:
+        kind = _VALUE, None
+    _STRUCT_KINDS[cls] = kind
+    return kind
+
+
+def _array_items(array, ident, max_items):
+    prefix = ' ' * ident + ' '
+    for i, item in enumerate(array):
+        if max_items is not None and i >= max_items:
+            yield prefix + '...\n', _SKIP
+            break
+        yield prefix, item
+    yield ' ' * ident + ']\n', _SKIP
+
+
+def _struct_items(struct, names, ident):
+    prefix = ' ' * ident
+    for name in names:
+        yield prefix + name + ': ', getattr(struct, name)
+
+
+def iter_format_struct(struct, ident=0, max_depth=None, max_items=None):
+    """
+    yields the formatted representation of struct (see print_struct)
+    in pieces
+
+    Arguments:
+        struct -- ctypes or binary.Structure instance, array or value
+        ident -- initial indentation
+        max_depth -- maximal number of nested levels to print
+        max_items -- maximal number of array elements to print
+    """
+    # explicit stack of (item generator, indentation) instead of recursion
+    stack = []
+    value = struct
+    level = ident
+    while True:
+        if value is not _SKIP:
+            kind, names = _struct_kind(type(value))
+            if kind == _VALUE:
+                yield '{}\n'.format(value)
+            elif max_depth is not None and level - ident >= max_depth:
+                yield '...\n'
+            elif kind == _ARRAY:
+                yield '[\n'
+                stack.append((_array_items(value, level, max_items), level + 1))
+            else:
+                if level:
+                    yield '\n'
+                stack.append((_struct_items(value, names, level), level + 1))
+
+        while stack:
+            items, level = stack[-1]
+            try:
+                text, value = next(items)
+            except StopIteration:
+                stack.pop()
+                continue
+            yield text
+            break
+        else:
+            return
+
+
+def format_struct(struct, ident=0, max_depth=None, max_items=None):
+    """
+    returns the formatted representation of struct (see print_struct)
+    """
+    return ''.join(iter_format_struct(struct, ident, max_depth, max_items))
+
+
+def print_struct(struct, ident=0, file=None, max_depth=None, max_items=None,
+                 chunk_size=65536):
     """
     >>> from ctypes import *
     >>> class Test(Structure):
@@ -431,40 +657,97 @@ def print_struct(struct, ident=0):
     foo: 
      foo: 2
     bar: 1
+    >>> print_struct((c_int * 4)(1, 2, 3, 4), max_items=2)
+    [
+     1
+     2
+     ...
+    ]
+    >>> print_struct(t, max_depth=1)
+    foo: ...
+    bar: 1
+
+    The output is collected and written in chunks of chunk_size
+    characters.
     """
-    if not isinstance(struct, (str, bytes, list, tuple)) and hasattr(struct, '__getitem__'): # array
-        print('[')
-        for item in struct:
-            print(" "*ident, end=' ')
-            print_struct(item, ident+1)
-        print(" "*ident + "]")
-    elif not hasattr(struct, '_fields_'):
-        print(struct)
-    else:
-        if ident:
-            print()
+    if file is None:
+        file = sys.stdout
+    pieces = []
+    size = 0
+    for piece in iter_format_struct(struct, ident, max_depth, max_items):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            file.write(''.join(pieces))
+            pieces = []
+            size = 0
+    file.write(''.join(pieces))
+
+
+_STRUCTS = {}
+
+
+def _compile(format):
+    """
+    returns a cached, compiled struct.Struct for the given format
+    """
+    try:
+        return _STRUCTS[format]
+    except KeyError:
+        compiled = _STRUCTS[format] = struct.Struct(format)
+        return compiled
 
-        for name, _ in struct._fields_:
-            print(" "*ident + "{}:".format(name), end=' ')
-            print_struct(getattr(struct, name), ident+1)
+
+_INTEGER_CODES = tuple('bBhHiIlLqQnN')
+
+
+def _split_byte_order(format):
+    if format.startswith(('<', '>', '!', '@', '=')):
+        return format[0], format[1:]
+    return '', format
 
 
 class StructField:
-    '''
+    """
     Descriptor representing a simple structure field
-    '''
-    def __init__(self, format, offset):
+
+    The offset is None if the field follows a variable sized member.
+    Its position is then resolved from the layout of the instance.
+    """
+    def __init__(self, format, offset, name=None, index=None):
         self.format = format
         self.offset = offset
+        self.name = name
+        self.index = index
+        self.struct = _compile(format)
+        self.size = self.struct.size
+        #: set by StructureMeta if a VariableStructField depends on it
+        self.is_length = False
+        #: number of values packed by the format
+        self.count = len(self.struct.unpack(b'\x00' * self.size))
+
+    def _offset(self, instance):
+        if self.offset is None:
+            return instance._field_offset(self.index)
+        return self.offset
+
+    def field_size(self, buffer, offsets):
+        """
+        returns the size of the field inside the given buffer
+
+        Arguments:
+            buffer -- buffer of the structure
+            offsets -- offsets of all previous fields
+        """
+        return self.size
 
     def __get__(self, instance, cls):
         if instance is None:
             return self
         else:
-            r = struct.unpack_from(
-                    self.format,
+            r = self.struct.unpack_from(
                     instance._buffer,
-                    self.offset
+                    self._offset(instance)
             )
 
         return r[0] if len(r) == 1 else r
@@ -476,36 +759,56 @@ class StructField:
         if not isinstance(values, (list,tuple)):
             values = [values]
 
-        struct.pack_into(
-            self.format,
+        self.struct.pack_into(
             instance._buffer,
-            self.offset,
+            self._offset(instance),
             *values
         )
+        if self.is_length:
+            instance._invalidate_layout()
 
     def __repr__(self):
         return '{}(format={!r}, offset={!r})'.format(type(self).__name__, self.format, self.offset)
 
 
 class VariableStructField(StructField):
-    def __init__(self, format, offset, length_field):
-        super(VariableStructField, self).__init__(format, offset)
+    """
+    Descriptor representing a field whose element count is stored in
+    another (previous) field of the same structure
+    """
+    def __init__(self, format, offset, length_field, name=None, index=None):
+        self._byte_order, self._code = _split_byte_order(format)
+        super(VariableStructField, self).__init__(
+            self._byte_order + '0' + self._code, offset, name, index)
         self.length_field = length_field
+        #: descriptor of the length field, resolved by StructureMeta
+        self.length_descriptor = None
+        self._structs = {}
+
+    def _struct(self, length):
+        try:
+            return self._structs[length]
+        except KeyError:
+            compiled = self._structs[length] = struct.Struct(
+                '{0}{1}{2}'.format(self._byte_order, length, self._code))
+            return compiled
+
+    def field_size(self, buffer, offsets):
+        field = self.length_descriptor
+        length = field.struct.unpack_from(buffer, offsets[field.index])[0]
+        return self._struct(length).size
 
     def __get__(self, instance, cls):
         if instance is None:
             return self
         else:
-            length = getattr(instance, self.length_field)
-            self.format = "{0}{1}{2}".format(
-                self.format[0],
-                length,
-                self.format[1:]
-            )
-            missing = struct.calcsize(self.format) + self.offset - len(instance._buffer)
+            compiled = self._struct(getattr(instance, self.length_field))
+            offset = self._offset(instance)
+            missing = compiled.size + offset - len(instance._buffer)
             if missing > 0:
                 raise IOError('Requires {} additional bytes'.format(missing))
-            return super(VariableStructField, self).__get__(instance, cls)
+            r = compiled.unpack_from(instance._buffer, offset)
+            return r[0] if len(r) == 1 else r
 
     def __set__(self, instance, value):
         if instance is None:
@@ -516,101 +819,781 @@ class VariableStructField(StructField):
         if length != length2:
             raise ValueError('Different lengths for length field ({} vs {})'.format(length, length2))
         # setattr(instance, self.length_field, length)
-        self.format = "{0}{1}{2}".format(
-            self.format[0],
-            length,
-            self.format[-1]
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        self._struct(length).pack_into(
+            instance._buffer,
+            self._offset(instance),
+            *value
         )
-        super(VariableStructField, self).__set__(instance, value)
+
+
+class BitField:
+    """
+    Descriptor representing a range of bits inside an integer field
+
+    Masks and shifts are precomputed, reads and writes go directly
+    through the buffer of the container field.
+    """
+    def __init__(self, name, container, bit_offset, width):
+        self.name = name
+        self.container = container
+        self.bit_offset = bit_offset
+        self.width = width
+        self.mask = (1 << width) - 1
+        bits = container.size * 8
+        self.clear_mask = ((1 << bits) - 1) & ~(self.mask << bit_offset)
+        #: signed containers need the value to be converted back
+        self.sign_bit = 1 << (bits - 1) if container.format[-1].islower() \
+            else 0
+        self.sign_offset = 1 << bits
+
+    def __get__(self, instance, cls):
+        if instance is None:
+            return self
+        container = self.container
+        value = container.struct.unpack_from(
+            instance._buffer, container._offset(instance))[0]
+        return (value >> self.bit_offset) & self.mask
+
+    def __set__(self, instance, value):
+        if value & ~self.mask:
+            raise ValueError('{!r} does not fit into {} bits of {}'.format(
+                value, self.width, self.name))
+        container = self.container
+        offset = container._offset(instance)
+        compiled = container.struct
+        current = compiled.unpack_from(instance._buffer, offset)[0]
+        current = (current & self.clear_mask) | (value << self.bit_offset)
+        if current & self.sign_bit:
+            current -= self.sign_offset
+        compiled.pack_into(instance._buffer, offset, current)
+
+    def __repr__(self):
+        return '{}(container={!r}, bit_offset={!r}, width={!r})'.format(
+            type(self).__name__, self.container.name, self.bit_offset,
+            self.width)
+
+
+_NATIVE_BYTE_ORDERS = ('', '@', '=', '<' if sys.byteorder == 'little' else '>')
+
+
+class _ArrayView(object):
+    """
+    Array view over a buffer for byte orders memoryview.cast can't handle
+    """
+    def __init__(self, buffer, item, length):
+        self._buffer = buffer
+        self._item = item
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def _index(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('index out of range')
+        return index * self._item.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        return self._item.unpack_from(self._buffer, self._index(index))[0]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            for i, v in zip(range(*index.indices(self._length)), value):
+                self[i] = v
+        else:
+            self._item.pack_into(self._buffer, self._index(index), value)
+
+    def __iter__(self):
+        for values in self._item.iter_unpack(self._buffer):
+            yield values[0]
+
+    def __eq__(self, other):
+        return self.tolist() == list(other)
+
+    def tolist(self):
+        return list(self)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.tolist())
+
+
+class ArrayField(StructField):
+    """
+    Descriptor representing a fixed size array of simple values
+
+    Returns a typed memoryview over the structure buffer, so elements are
+    read and written in place without creating a tuple of all values.
+    If the byte order isn't the native one a generic view is returned.
+    """
+    def __init__(self, format, offset, length, name=None, index=None):
+        byte_order, code = _split_byte_order(format)
+        if len(code) != 1 or code in 'sSpPx':
+            raise TypeError('Unsupported array format {!r}'.format(format))
+        super(ArrayField, self).__init__(
+            '{0}{1}{2}'.format(byte_order, length, code), offset, name, index)
+        self.length = length
+        self.code = code
+        self.item = _compile(byte_order + code)
+        self.native = byte_order in _NATIVE_BYTE_ORDERS and \
+            struct.calcsize(code) == self.item.size
+        if self.native:
+            try:
+                memoryview(bytearray(self.item.size)).cast(code)
+            except (TypeError, ValueError):
+                self.native = False
+
+    def __get__(self, instance, cls):
+        if instance is None:
+            return self
+        offset = self._offset(instance)
+        data = instance._buffer[offset:offset + self.size]
+        if len(data) != self.size:
+            raise IOError('Requires {} additional bytes'.format(
+                self.size - len(data)))
+        if self.native:
+            return data.cast(self.code)
+        return _ArrayView(data, self.item, self.length)
+
+    def __set__(self, instance, values):
+        super(ArrayField, self).__set__(instance, list(values))
+
+    def numpy_dtype(self):
+        """
+        returns the matching numpy dtype of an element
+        """
+        import numpy
+        byte_order = _split_byte_order(self.format)[0]
+        byte_order = {'<': '<', '>': '>', '!': '>'}.get(byte_order, '=')
+        if self.code == '?':
+            kind = 'b'
+        elif self.code in 'efd':
+            kind = 'f'
+        elif self.code.islower():
+            kind = 'i'
+        else:
+            kind = 'u'
+        return numpy.dtype('{}{}{}'.format(byte_order, kind, self.item.size))
+
+
+class StructArray(object):
+    """
+    Sequence of nested structures sharing the buffer of the parent
+    """
+    def __init__(self, struct_type, buffer, length):
+        self.struct_type = struct_type
+        self._buffer = buffer
+        self._length = length
+        self._size = struct_type.struct_size
+
+    def __len__(self):
+        return self._length
+
+    def _index(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('index out of range')
+        return index * self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        offset = self._index(index)
+        return self.struct_type(self._buffer[offset:offset + self._size])
+
+    def __setitem__(self, index, value):
+        offset = self._index(index)
+        if isinstance(value, Structure):
+            self._buffer[offset:offset + self._size] = \
+                value._buffer[:self._size]
+        else:
+            self.struct_type._pack_records([value], self._buffer, offset)
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, StructArray):
+            return NotImplemented
+        return self.struct_type is other.struct_type and \
+            self._buffer == other._buffer
+
+    def tolist(self):
+        return list(self)
+
+    def __repr__(self):
+        return repr(self.tolist())
 
 
 class NestedStruct:
-    '''
+    """
     Descriptor representing a nested structure
-    '''
-    def __init__(self, name, struct_type, offset):
+    """
+    def __init__(self, name, struct_type, offset, index=None):
         self.name = name
         self.struct_type = struct_type
         self.offset = offset
+        self.index = index
+        self.size = struct_type.struct_size
+
+    def field_size(self, buffer, offsets):
+        if not self.struct_type._dynamic_:
+            return self.size
+        return self.struct_type._dynamic_struct_size(
+            buffer[offsets[self.index]:])
 
     def __get__(self, instance, cls):
         if instance is None:
             return self
         else:
-            data = instance._buffer[
-                self.offset:
-                self.offset + self.struct_type._dynamic_struct_size()
-            ]
+            if self.offset is None:
+                offset = instance._field_offset(self.index)
+            else:
+                offset = self.offset
+            data = instance._buffer[offset:]
+            data = data[:self.struct_type._dynamic_struct_size(data)]
             result = self.struct_type(data)
+            result._parent = instance
             # Save resulting structure back on instance to avoid
             # further recomputation of this step
             setattr(instance, self.name, result)
             return result
 
+    def __repr__(self):
+        return '{}(struct_type={}, offset={!r})'.format(
+            type(self).__name__, self.struct_type.__name__, self.offset)
+
+
+def _generate_accessors(cls):
+    """
+    replaces the simple field descriptors of cls with generated
+    properties and adds generated __repr__, __eq__ and to_dict methods
+    (similar to namedtuple or dataclasses)
+    """
+    namespace = {
+        '_field_names': tuple(cls._field_names_),
+        '_repr_template': '{}({})'.format(
+            cls.__name__,
+            ', '.join(name + '={!r}' for name in cls._field_names_)
+        ),
+    }
+    for name in cls._field_names_:
+        if keyword.iskeyword(name) or not re.match(r'[A-Za-z_]\w*$', name):
+            raise TypeError('Invalid field name {!r} in {}'.format(
+                name, cls.__name__))
+
+    source = []
+    properties = []
+    for descriptor in cls._descriptors_:
+        if type(descriptor) is not StructField or not descriptor.count:
+            continue
+        i = descriptor.index
+        namespace['_unpack_{}'.format(i)] = descriptor.struct.unpack_from
+        namespace['_pack_{}'.format(i)] = descriptor.struct.pack_into
+        if descriptor.offset is None:
+            offset = 'self._field_offset({})'.format(i)
+        else:
+            offset = repr(descriptor.offset)
+
+        if descriptor.count == 1:
+            source.append(
+                'def _get_{i}(self):\n'
+                '    return _unpack_{i}(self._buffer, {offset})[0]\n'
+                'def _set_{i}(self, value):\n'
+                '    if isinstance(value, (list, tuple)):\n'
+                '        value, = value\n'
+                '    _pack_{i}(self._buffer, {offset}, value)\n'.format(
+                    i=i, offset=offset))
+        else:
+            source.append(
+                'def _get_{i}(self):\n'
+                '    return _unpack_{i}(self._buffer, {offset})\n'
+                'def _set_{i}(self, value):\n'
+                '    _pack_{i}(self._buffer, {offset}, *value)\n'.format(
+                    i=i, offset=offset))
+        if descriptor.is_length:
+            source.append('    self._invalidate_layout()\n')
+        properties.append(descriptor)
+
+    for bitfields in cls._bitfields_.values():
+        for bitfield in bitfields:
+            container = bitfield.container
+            if container.offset is None:
+                offset = 'self._field_offset({})'.format(container.index)
+            else:
+                offset = repr(container.offset)
+            source.append(
+                'def _get_{name}(self):\n'
+                '    return (_unpack_{i}(self._buffer, {offset})[0] >> {shift}) '
+                '& {mask}\n'.format(
+                    name=bitfield.name, i=container.index, offset=offset,
+                    shift=bitfield.bit_offset, mask=bitfield.mask))
+
+    if cls._flat_records_ and cls._record_struct_ is not None:
+        # all fields are scalars at fixed offsets => unpack the whole record
+        namespace['_unpack_record'] = cls._record_struct_.unpack_from
+        source.append(
+            'def __repr__(self):\n'
+            '    return _repr_template.format(*_unpack_record(self._buffer, 0))\n'
+            'def __eq__(self, other):\n'
+            '    if other.__class__ is not self.__class__:\n'
+            '        return NotImplemented\n'
+            '    return _unpack_record(self._buffer, 0) == '
+            '_unpack_record(other._buffer, 0)\n'
+            'def to_dict(self):\n'
+            '    return dict(zip(_field_names, _unpack_record(self._buffer, 0)))\n')
+    else:
+        values = ''
+        compared = ''
+        other = ''
+        items = ''
+        for d in cls._descriptors_:
+            if isinstance(d, ArrayField):
+                value = '{{}}.{}.tolist()'.format(d.name)
+            else:
+                value = '{{}}.{}'.format(d.name)
+            values += value.format('self') + ', '
+            if type(d) is NestedStruct:
+                # nested structures without codegen have no __eq__
+                value = '{{}}.{}.to_dict()'.format(d.name)
+            compared += value.format('self') + ', '
+            other += value.format('other') + ', '
+            if isinstance(d, NestedStructArray):
+                items += "'{0}': [i.to_dict() for i in self.{0}], ".format(d.name)
+            elif isinstance(d, NestedStruct):
+                items += "'{0}': self.{0}.to_dict(), ".format(d.name)
+            else:
+                items += "'{0}': {1}, ".format(d.name, value.format('self'))
+        source.append(
+            'def __repr__(self):\n'
+            '    return _repr_template.format({values})\n'
+            'def __eq__(self, other):\n'
+            '    if other.__class__ is not self.__class__:\n'
+            '        return NotImplemented\n'
+            '    return ({compared}) == ({other})\n'
+            'def to_dict(self):\n'
+            '    return {{{items}}}\n'.format(
+                values=values, compared=compared, other=other, items=items))
+
+    six.exec_(''.join(source), namespace)
+
+    for descriptor in properties:
+        setattr(cls, descriptor.name, property(
+            namespace['_get_{}'.format(descriptor.index)],
+            namespace['_set_{}'.format(descriptor.index)],
+            doc=repr(descriptor)))
+    for bitfields in cls._bitfields_.values():
+        for bitfield in bitfields:
+            setattr(cls, bitfield.name, property(
+                namespace['_get_{}'.format(bitfield.name)],
+                bitfield.__set__,
+                doc=repr(bitfield)))
+    for name in ('__repr__', '__eq__', 'to_dict'):
+        function = namespace[name]
+        function.__qualname__ = '{}.{}'.format(cls.__name__, name)
+        setattr(cls, name, function)
+    cls.__hash__ = None
+
+
+class NestedStructArray(NestedStruct):
+    """
+    Descriptor representing a fixed size array of nested structures
+    """
+    def __init__(self, name, struct_type, offset, length, index=None):
+        if struct_type._dynamic_:
+            raise TypeError('Arrays of variable sized structures are '
+                            'not supported')
+        super(NestedStructArray, self).__init__(
+            name, struct_type, offset, index)
+        self.length = length
+        self.size = struct_type.struct_size * length
+
+    def field_size(self, buffer, offsets):
+        return self.size
+
+    def __get__(self, instance, cls):
+        if instance is None:
+            return self
+        if self.offset is None:
+            offset = instance._field_offset(self.index)
+        else:
+            offset = self.offset
+        data = instance._buffer[offset:offset + self.size]
+        if len(data) != self.size:
+            raise IOError('Requires {} additional bytes'.format(
+                self.size - len(data)))
+        return StructArray(self.struct_type, data, self.length)
+
+    def __set__(self, instance, values):
+        if len(values) != self.length:
+            raise ValueError('Expected {} elements, got {}'.format(
+                self.length, len(values)))
+        array = self.__get__(instance, type(instance))
+        for i, value in enumerate(values):
+            array[i] = value
+
+    def __repr__(self):
+        return '{}(struct_type={}, offset={!r}, length={!r})'.format(
+            type(self).__name__, self.struct_type.__name__, self.offset,
+            self.length)
+
 
 class StructureMeta(type):
-    '''
+    """
     Metaclass that automatically creates StructField descriptors
-    '''
+
+    Fields are given as ``(format, name)`` or, for variable sized fields,
+    as ``(format, name, length_field)``. Fixed size arrays of simple
+    values or structures are given as ``(format, name, length)``.
+    Integer fields may carry
+    bitfields as ``(format, name, [(bitname, bit_offset, width), ...])``.
+    Offsets of fields following a
+    variable sized member are computed per instance in a single pass
+    over the length fields (see `_compute_layout`).
+
+    `struct_size` is the minimal size of a structure, variable sized
+    fields count as empty. (Before variable sized fields were supported
+    properly, they counted as one element.) The actual size of an
+    instance is `dynamic_size`.
+
+    Classes setting ``_codegen_ = True`` get generated properties for
+    their simple fields as well as generated __repr__, __eq__ and to_dict
+    methods instead of the generic descriptor based ones.
+    """
     def __init__(self, clsname, bases, clsdict):
         fields = getattr(self, '_fields_', [])
         byte_order = ''
         offset = 0
-        for field in fields:
+        size = 0
+        descriptors = []
+        static = None
+        named = {}
+        containers = {}
+        for index, field in enumerate(fields):
             length_field = None
+            bits = None
+            array_length = None
             if len(field) == 3:
                 format, fieldname, length_field = field
+                if isinstance(length_field, (list, tuple)):
+                    bits, length_field = length_field, None
+                elif isinstance(length_field, six.integer_types):
+                    array_length, length_field = length_field, None
             else:
                 format, fieldname = field
 
             if isinstance(format, StructureMeta):
-                setattr(self, fieldname,
-                        NestedStruct(fieldname, format, offset))
-                offset += format.struct_size
+                if array_length is not None:
+                    descriptor = NestedStructArray(
+                        fieldname, format, offset, array_length, index)
+                    dynamic = False
+                else:
+                    descriptor = NestedStruct(fieldname, format, offset, index)
+                    dynamic = format._dynamic_
             else:
                 if format.startswith(('<', '>', '!', '@')):
                     byte_order = format[0]
                     format = format[1:]
                 format = byte_order + format
                 if length_field:
-                    setattr(self, fieldname, VariableStructField(format, offset, length_field))
+                    length_descriptor = named.get(length_field)
+                    if not isinstance(length_descriptor, StructField) or \
+                            isinstance(length_descriptor, VariableStructField):
+                        raise TypeError(
+                            'Length field {!r} of {}.{} has to be a '
+                            'previous field'.format(
+                                length_field, clsname, fieldname))
+                    length_descriptor.is_length = True
+                    descriptor = VariableStructField(
+                        format, offset, length_field, fieldname, index)
+                    descriptor.length_descriptor = length_descriptor
+                    dynamic = True
+                elif array_length is not None:
+                    descriptor = ArrayField(
+                        format, offset, array_length, fieldname, index)
+                    dynamic = False
+                else:
+                    descriptor = StructField(format, offset, fieldname, index)
+                    dynamic = False
+
+            setattr(self, fieldname, descriptor)
+            named[fieldname] = descriptor
+            descriptors.append(descriptor)
+            if bits:
+                if type(descriptor) is not StructField or \
+                        descriptor.count != 1 or \
+                        not descriptor.format.endswith(_INTEGER_CODES):
+                    raise TypeError(
+                        'Bitfield container {}.{} has to be a single '
+                        'integer'.format(clsname, fieldname))
+                containers[fieldname] = []
+                for name, bit_offset, width in bits:
+                    if bit_offset < 0 or width < 1 or \
+                            bit_offset + width > descriptor.size * 8:
+                        raise TypeError(
+                            'Bitfield {}.{} exceeds its container'.format(
+                                clsname, name))
+                    bitfield = BitField(name, descriptor, bit_offset, width)
+                    setattr(self, name, bitfield)
+                    containers[fieldname].append(bitfield)
+            size += descriptor.size
+            if dynamic and static is None:
+                static = index + 1
+            if offset is not None:
+                offset = None if dynamic else offset + descriptor.size
+
+        self._descriptors_ = descriptors
+        #: BitField descriptors by the name of their container field
+        self._bitfields_ = containers
+        #: number of leading fields with a fixed offset
+        self._static_fields_ = len(descriptors) if static is None else static
+        self._dynamic_ = static is not None
+        #: minimal size of the structure (all variable fields empty)
+        self.struct_size = size
+        self._field_names_ = [descriptor.name for descriptor in descriptors]
+        self._compile_records()
+        self._build_offset_table()
+        if getattr(self, '_codegen_', False):
+            _generate_accessors(self)
+
+    def _build_offset_table(self):
+        """
+        builds the sorted table of all fields (including the fields of
+        nested structures) with a fixed offset
+        """
+        table = []
+        for descriptor in self._descriptors_:
+            if descriptor.offset is None:
+                break
+            if isinstance(descriptor, NestedStruct):
+                nested = descriptor.struct_type
+                if isinstance(descriptor, NestedStructArray):
+                    prefixes = ['{}[{}].'.format(descriptor.name, i)
+                                for i in range(descriptor.length)]
                 else:
-                    setattr(self, fieldname, StructField(format, offset))
-                offset += struct.calcsize(format)
-            setattr(self, 'struct_size', offset)
+                    prefixes = [descriptor.name + '.']
+                for i, prefix in enumerate(prefixes):
+                    start = descriptor.offset + i * nested.struct_size
+                    table.extend(FieldInfo(start + field.offset, field.size,
+                                           prefix + field.path,
+                                           field.descriptor)
+                                 for field in nested._offset_table_)
+            elif descriptor.size:
+                table.append(FieldInfo(descriptor.offset, descriptor.size,
+                                       descriptor.name, descriptor))
+        self._offset_table_ = table
+        self._offset_starts_ = [field.offset for field in table]
+
+    @property
+    def offset_table(self):
+        """
+        sorted list of FieldInfo tuples for all fields with a fixed offset,
+        nested structures are flattened ("header.size", "items[2].id")
+        """
+        return list(self._offset_table_)
+
+    def field_at(self, offset):
+        """
+        returns the FieldInfo of the field covering the given byte offset
+        or None. Elements of array fields are resolved to "name[index]".
+        """
+        i = bisect_right(self._offset_starts_, offset) - 1
+        if i < 0:
+            return None
+        field = self._offset_table_[i]
+        if offset >= field.offset + field.size:
+            return None
+        descriptor = field.descriptor
+        if isinstance(descriptor, ArrayField):
+            index = (offset - field.offset) // descriptor.item.size
+            return FieldInfo(field.offset + index * descriptor.item.size,
+                             descriptor.item.size,
+                             '{}[{}]'.format(field.path, index), descriptor)
+        return field
+
+    def fields_in_range(self, start, end):
+        """
+        returns the FieldInfo tuples of all fields overlapping the byte
+        range [start, end)
+        """
+        table = self._offset_table_
+        i = max(bisect_right(self._offset_starts_, start) - 1, 0)
+        fields = []
+        while i < len(table) and table[i].offset < end:
+            field = table[i]
+            if field.offset + field.size > start:
+                fields.append(field)
+            i += 1
+        return fields
+
+    def _compile_records(self):
+        """
+        prepares packing of whole records with a single struct.Struct
+
+        Falls back to packing field by field if the fields use different
+        byte orders or the native alignment would insert padding.
+        """
+        self._record_struct_ = None
+        self._record_fields_ = None
+        #: records are plain tuples with one value per field
+        self._flat_records_ = False
+        self._record_getter_ = None
+        if self._dynamic_:
+            return
+
+        fields = []
+        byte_orders = set()
+        codes = []
+        for descriptor in self._descriptors_:
+            if isinstance(descriptor, NestedStruct):
+                nested = descriptor.struct_type
+                repeat = getattr(descriptor, 'length', 1)
+                for i in range(repeat):
+                    start = descriptor.offset + i * nested.struct_size
+                    fields.extend((compiled, start + offset, count)
+                                  for compiled, offset, count
+                                  in nested._record_fields_)
+                if nested._record_struct_ is None:
+                    byte_orders.add(None)
+                else:
+                    byte_order, code = _split_byte_order(
+                        nested._record_struct_.format)
+                    byte_orders.add(byte_order or '@')
+                    codes.append(code * repeat)
+            else:
+                fields.append((descriptor.struct, descriptor.offset,
+                               descriptor.count))
+                byte_order, code = _split_byte_order(descriptor.format)
+                byte_orders.add(byte_order or '@')
+                codes.append(code)
+
+        self._record_fields_ = fields
+        self._flat_records_ = all(
+            type(d) is StructField and d.count == 1
+            for d in self._descriptors_)
+        if len(byte_orders) == 1 and None not in byte_orders:
+            compiled = struct.Struct(byte_orders.pop() + ''.join(codes))
+            if compiled.size == self.struct_size:
+                self._record_struct_ = compiled
+        if len(self._field_names_) == 1:
+            name = self._field_names_[0]
+            self._record_getter_ = lambda record: (record[name],)
+        elif self._field_names_:
+            self._record_getter_ = itemgetter(*self._field_names_)
+
+    def _flatten(self, record):
+        """
+        returns the values of a record (tuple or dict) as a flat list
+        """
+        if isinstance(record, Structure):
+            record = record.to_dict()
+        if isinstance(record, dict):
+            record = [record[name] for name in self._field_names_]
+        values = []
+        for descriptor, value in zip(self._descriptors_, record):
+            if isinstance(descriptor, NestedStructArray):
+                for item in value:
+                    values.extend(descriptor.struct_type._flatten(item))
+            elif isinstance(descriptor, NestedStruct):
+                values.extend(descriptor.struct_type._flatten(value))
+            elif isinstance(descriptor, ArrayField):
+                values.extend(value)
+            elif descriptor.count == 1:
+                values.append(value)
+            elif descriptor.count:
+                values.extend(value)
+        return values
+
+    def _pack_fields(self, buffer, offset, *values):
+        i = 0
+        for compiled, field_offset, count in self._record_fields_:
+            compiled.pack_into(buffer, offset + field_offset,
+                               *values[i:i + count])
+            i += count
+
+    def _pack_records(self, records, buffer, offset):
+        """
+        packs records into buffer starting at offset and returns the
+        number of packed records
+        """
+        if self._dynamic_:
+            raise TypeError('{} contains variable sized fields'.format(
+                self.__name__))
+        size = self.struct_size
+        flat = self._flat_records_
+        getter = self._record_getter_
+        flatten = self._flatten
+        if self._record_struct_ is not None:
+            pack_into = self._record_struct_.pack_into
+        else:
+            pack_into = self._pack_fields
+        count = 0
+        for record in records:
+            if not flat:
+                record = flatten(record)
+            elif isinstance(record, dict):
+                record = getter(record)
+            pack_into(buffer, offset, *record)
+            offset += size
+            count += 1
+        return count
 
     def __str__(self):
         lines = [
                 '{0}(0x{1:x}, {1}):'.format(type(self).__name__, self.struct_size)
         ]
 
-        for field in getattr(self, '_fields_', []):
-            lines.append('  0x{0:02x} {0:3}: {1}'.format(
-                    getattr(self, field[1]).offset,
-                    field[1]
-                )
-            )
+        for descriptor in self._descriptors_:
+            if descriptor.offset is None:
+                lines.append('  {0:>8}: {1}'.format('dynamic', descriptor.name))
+            else:
+                lines.append('  0x{0:02x} {0:3}: {1}'.format(
+                    descriptor.offset, descriptor.name))
 
         return '\n'.join(lines)
 
-    def _dynamic_struct_size(self):
-        size = 0
-        for data in getattr(self, '_fields_', []):
-            format, field = data[:2]
-            field = getattr(self, field)
-            # TODO: calc dynamic size
-            if False: #hasattr(field, 'struct_size'):
-                size += field._dynamic_struct_size()
-            elif hasattr(format, 'struct_size'):
-                size += format.struct_size
-            else:
-                size += struct.calcsize(format)
-
-        return size
+    def _compute_layout(self, buffer):
+        """
+        returns the offsets of all fields and the total size of the
+        structure stored in buffer
+        """
+        descriptors = self._descriptors_
+        static = self._static_fields_
+        offsets = [d.offset for d in descriptors[:static]]
+        if not offsets:
+            return offsets, 0
+        offset = offsets[-1]
+        for descriptor in descriptors[static - 1:]:
+            if len(offsets) <= descriptor.index:
+                offsets.append(offset)
+            offset += descriptor.field_size(buffer, offsets)
+
+        return offsets, offset
+
+    def _dynamic_struct_size(self, buffer=None):
+        """
+        returns the size of the structure stored in buffer or the
+        minimal size if no buffer is given
+        """
+        if not self._dynamic_ or buffer is None:
+            return self.struct_size
+        return self._compute_layout(buffer)[1]
 
 
 @six.add_metaclass(StructureMeta)
 class Structure():
+    #: cached result of _compute_layout for dynamic structures
+    _layout = None
+    #: structure this one was read from as nested field
+    _parent = None
+
     def __init__(self, bytedata=None):
         if bytedata is None:
             bytedata = bytearray(self.struct_size)
@@ -619,16 +1602,138 @@ class Structure():
         if not isinstance(bytedata, memoryview):
             bytedata = memoryview(bytedata)
         self._buffer = bytedata
+        self._layout = None
 
     def __repr__(self):
-        fields = getattr(self, '_fields_', [])
-        attrs = ['{}={!r}'.format(f[1], getattr(self, f[1])) for f in fields]
+        attrs = []
+        for name in self._field_names_:
+            value = getattr(self, name)
+            if isinstance(value, (memoryview, _ArrayView)):
+                value = value.tolist()
+            attrs.append('{}={!r}'.format(name, value))
         return '{}({})'.format(type(self).__name__, ', '.join(attrs))
 
+    def to_dict(self):
+        """
+        returns the field values as dict (nested structures as dicts)
+        """
+        result = {}
+        for name in self._field_names_:
+            value = getattr(self, name)
+            if isinstance(value, Structure):
+                value = value.to_dict()
+            elif isinstance(value, StructArray):
+                value = [item.to_dict() for item in value]
+            elif isinstance(value, (memoryview, _ArrayView)):
+                value = value.tolist()
+            result[name] = value
+        return result
+
+    def numpy_view(self, name):
+        """
+        returns a numpy array sharing the buffer of the given array field
+        (requires numpy)
+        """
+        import numpy
+        descriptor = self._descriptors_[self._field_names_.index(name)]
+        if not isinstance(descriptor, ArrayField):
+            raise TypeError('{} is not an array field'.format(name))
+        return numpy.frombuffer(
+            self._buffer,
+            dtype=descriptor.numpy_dtype(),
+            count=descriptor.length,
+            offset=descriptor._offset(self)
+        )
+
+    def _invalidate_layout(self):
+        """
+        drops the cached layouts after a length field changed, including
+        those of the structures this one is nested in. Nested structures
+        cached by these have to be read from their parent again, as
+        their size or offset may have changed.
+        """
+        instance = self
+        while instance is not None:
+            instance._layout = None
+            for descriptor in instance._descriptors_:
+                if type(descriptor) is NestedStruct and (
+                        descriptor.offset is None or
+                        descriptor.struct_type._dynamic_):
+                    instance.__dict__.pop(descriptor.name, None)
+            instance = instance._parent
+
+    def _field_offset(self, index):
+        layout = self._layout
+        if layout is None:
+            layout = self._layout = type(self)._compute_layout(self._buffer)
+        return layout[0][index]
+
+    def decode_bitfields(self, container):
+        """
+        returns all bitfields of the given container field as dict,
+        decoded from a single read of the container
+        """
+        bitfields = self._bitfields_[container]
+        value = getattr(self, container)
+        return dict((bitfield.name, (value >> bitfield.bit_offset) & bitfield.mask)
+                    for bitfield in bitfields)
+
     @classmethod
     def from_file(cls, f, additional=0):
+        """
+        reads struct_size + additional bytes from f. For structures with
+        variable sized fields struct_size is the minimal size, the size
+        of their variable fields has to be passed as additional.
+        """
         return cls(f.read(cls.struct_size + additional))
 
+    @classmethod
+    def pack_many(cls, records, buffer=None, offset=0):
+        """
+        packs many records into one buffer and returns the buffer
+
+        Arguments:
+            records -- iterable of tuples (one value per field) or dicts
+            buffer -- preallocated writable buffer, e.g. bytearray or mmap
+                      (Default: a new bytearray of the required size)
+            offset -- start offset inside buffer
+        """
+        if buffer is None:
+            if not hasattr(records, '__len__'):
+                records = list(records)
+            buffer = bytearray(offset + len(records) * cls.struct_size)
+        cls._pack_records(records, buffer, offset)
+        return buffer
+
+    @classmethod
+    def write_many(cls, f, records, chunk_size=4096):
+        """
+        packs records and writes them to the file f in chunks of
+        chunk_size records. Returns the number of written records.
+        """
+        buffer = bytearray(chunk_size * cls.struct_size)
+        view = memoryview(buffer)
+        records = iter(records)
+        total = 0
+        while True:
+            count = cls._pack_records(islice(records, chunk_size), buffer, 0)
+            if not count:
+                break
+            f.write(view[:count * cls.struct_size])
+            total += count
+        return total
+
+    @property
+    def dynamic_size(self):
+        """
+        size of the structure including all variable sized fields
+        """
+        if not self._dynamic_:
+            return self.struct_size
+        if self._layout is None:
+            self._layout = type(self)._compute_layout(self._buffer)
+        return self._layout[1]
+
     @property
     def raw_bytes(self):
         return bytes(self._buffer)
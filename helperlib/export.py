@@ -0,0 +1,262 @@
+from __future__ import absolute_import, unicode_literals
+
+import binascii
+import csv
+import io
+import json
+import threading
+
+import six
+from six.moves import queue
+
+from .binary import ArrayField, NestedStruct, NestedStructArray
+
+
+__all__ = ['column_names', 'iter_columns', 'export_records']
+
+
+def column_names(struct_type, prefix=''):
+    """
+    returns the flattened column names of a structure
+
+    Nested structures are prefixed with their field name ("header.size"),
+    values of multi value fields are suffixed with their index ("data[0]").
+    """
+    names = []
+    for descriptor in struct_type._descriptors_:
+        name = prefix + descriptor.name
+        if isinstance(descriptor, NestedStructArray):
+            for i in range(descriptor.length):
+                names.extend(column_names(
+                    descriptor.struct_type, '{}[{}].'.format(name, i)))
+        elif isinstance(descriptor, NestedStruct):
+            names.extend(column_names(descriptor.struct_type, name + '.'))
+        elif descriptor.count == 1 and not isinstance(descriptor, ArrayField):
+            names.append(name)
+        else:
+            names.extend('{}[{}]'.format(name, i)
+                         for i in range(descriptor.count))
+    return names
+
+
+def _decode_columns(struct_type, chunk, count):
+    compiled = struct_type._record_struct_
+    if compiled is not None:
+        return list(zip(*compiled.iter_unpack(chunk)))
+
+    size = struct_type.struct_size
+    columns = []
+    for compiled, offset, values in struct_type._record_fields_:
+        if not values:
+            continue
+        unpack_from = compiled.unpack_from
+        rows = [unpack_from(chunk, offset + i * size) for i in range(count)]
+        if values == 1:
+            columns.append([row[0] for row in rows])
+        else:
+            columns.extend(zip(*rows))
+    return columns
+
+
+def _read_chunks(source, size):
+    if not hasattr(source, 'readinto'):
+        data = memoryview(source)
+        for start in range(0, len(data), size):
+            yield data[start:start + size]
+        return
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    while True:
+        filled = 0
+        while filled < size:
+            read = source.readinto(view[filled:])
+            if not read:
+                break
+            filled += read
+        if not filled:
+            return
+        yield view[:filled]
+        if filled < size:
+            return
+
+
+def iter_columns(struct_type, source, chunk_size=65536):
+    """
+    yields the records of source as list of columns, chunk_size
+    records at a time
+
+    Arguments:
+        struct_type -- Structure class of the records
+        source -- bytes-like object or binary file object
+        chunk_size -- number of records decoded at once
+    """
+    if struct_type._dynamic_:
+        raise TypeError('{} contains variable sized fields'.format(
+            struct_type.__name__))
+    size = struct_type.struct_size
+    for chunk in _read_chunks(source, chunk_size * size):
+        count, missing = divmod(len(chunk), size)
+        if missing:
+            raise IOError('Requires {} additional bytes'.format(size - missing))
+        yield _decode_columns(struct_type, chunk, count)
+
+
+def _text(columns):
+    # bytes values can't be written as text => hex encode them
+    return [
+        [binascii.hexlify(value).decode() for value in column]
+        if column and isinstance(column[0], bytes) else column
+        for column in columns
+    ]
+
+
+class _CSVWriter(object):
+    binary = False
+    newline = ''
+
+    def __init__(self, fp, names, struct_type):
+        self.writer = csv.writer(fp)
+        self.writer.writerow(names)
+
+    def write(self, columns):
+        self.writer.writerows(zip(*_text(columns)))
+
+    def close(self):
+        pass
+
+
+class _NDJSONWriter(object):
+    binary = False
+    newline = None
+
+    def __init__(self, fp, names, struct_type):
+        self.fp = fp
+        self.names = names
+        self.encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def write(self, columns):
+        names = self.names
+        encode = self.encode
+        self.fp.write(''.join(
+            encode(dict(zip(names, row))) + '\n'
+            for row in zip(*_text(columns))
+        ))
+
+    def close(self):
+        pass
+
+
+class _ArrowWriter(object):
+    binary = True
+    newline = None
+
+    def __init__(self, fp, names, struct_type):
+        import pyarrow
+        self.pyarrow = pyarrow
+        # the schema is written up front (a file without records still
+        # needs it), so derive the column types from an all zero record
+        sample = _decode_columns(
+            struct_type, bytes(bytearray(struct_type.struct_size)), 1)
+        self.schema = pyarrow.schema([
+            (name, pyarrow.array(column).type)
+            for name, column in zip(names, sample)])
+        self.writer = pyarrow.ipc.new_file(fp, self.schema)
+
+    def write(self, columns):
+        pyarrow = self.pyarrow
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(column, type=field.type)
+             for column, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+_WRITERS = {
+    'csv': _CSVWriter,
+    'ndjson': _NDJSONWriter,
+    'arrow': _ArrowWriter,
+}
+
+
+class _Pipeline(threading.Thread):
+    """
+    writes chunks in the background while the next chunk gets decoded
+    """
+    def __init__(self, writer, depth):
+        super(_Pipeline, self).__init__(name='ExportPipeline')
+        self.daemon = True
+        self.writer = writer
+        self.queue = queue.Queue(depth)
+        self.error = None
+        self.start()
+
+    def run(self):
+        while True:
+            columns = self.queue.get()
+            if columns is None:
+                break
+            if self.error is None:
+                try:
+                    self.writer.write(columns)
+                except Exception as e:
+                    self.error = e
+
+    def write(self, columns):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(columns)
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+def export_records(struct_type, source, target, format='csv',
+                   chunk_size=65536, pipeline=True):
+    """
+    Decodes all records in source and writes them as table to target.
+    Returns the number of exported records.
+
+    Keyword arguments:
+    struct_type -- Structure class of the records
+    source -- bytes-like object or binary file object
+    target -- filename or file object (binary for arrow)
+    format -- "csv", "ndjson" or "arrow" (Arrow IPC, requires pyarrow)
+    chunk_size -- number of records decoded and written at once
+    pipeline -- write chunks in a background thread while decoding
+    """
+    try:
+        writer_type = _WRITERS[format]
+    except KeyError:
+        raise ValueError('Unknown format {!r}'.format(format))
+
+    if isinstance(target, six.string_types):
+        if writer_type.binary:
+            fp = open(target, 'wb')
+        else:
+            fp = io.open(target, 'w', newline=writer_type.newline)
+    else:
+        fp = target
+
+    count = 0
+    try:
+        writer = writer_type(fp, column_names(struct_type), struct_type)
+        output = _Pipeline(writer, 4) if pipeline else writer
+        try:
+            for columns in iter_columns(struct_type, source, chunk_size):
+                if columns:
+                    count += len(columns[0])
+                output.write(columns)
+        finally:
+            if pipeline:
+                output.close()
+        writer.close()
+    finally:
+        if fp is not target:
+            fp.close()
+    return count
@@ -1,60 +1,344 @@
 from __future__ import absolute_import, unicode_literals
 
+import atexit
+import collections
+import json
 import logging
 import logging.config
+import logging.handlers
 import re
+import sys
 import threading
+import time
 import os
 
+from six.moves import queue as _queue
+
 from .terminal import TerminalController
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+#: colour templates of the log levels
+LEVEL_COLORS = {
+    logging.DEBUG: "${CYAN}",
+    logging.INFO: "${GREEN}",
+    logging.WARNING: "${YELLOW}",
+    logging.ERROR: "${RED}",
+    logging.CRITICAL: "${BG_RED}",
+}
+
+
+def _colorize(term, fmt, pattern, replacement, color):
+    """
+    returns the rendered format and the escape sequence of each level
+    (None if the output isn't colored)
+    """
+    if not (color and term.NORMAL):
+        return (term.render(fmt) if fmt else fmt), None
+    if fmt:
+        fmt = term.render(re.sub(pattern, replacement, fmt))
+    return fmt, dict((level, term.render(template))
+                     for level, template in LEVEL_COLORS.items())
+
 
 class ColorFormatter(logging.Formatter):
+    """
+    Formatter which colors the level name (or number) of records
+
+    `${...}` sequences of the format and the level colors are rendered
+    once, messages are formatted like by logging.Formatter.
+
+    Keyword arguments:
+    stream -- stream of the terminal used for colors (Default: sys.stderr)
+    color -- False disables colors (Default: True if stream is a terminal)
+    """
+    _LEVEL_RE = r'%\(level(no|name)\)\d*s'
+    _LEVEL_FORMAT = r'%(levelcolor)s\g<0>%(levelreset)s'
+
     def __init__(self, fmt=None, *args, **kwargs):
-        if fmt:
-            fmt = re.sub(r'%\(level(no|name)\)\d*s',
-                         r'%(levelcolor)s\g<0>${NORMAL}', fmt)
+        stream = kwargs.pop('stream', None)
+        color = kwargs.pop('color', True)
+        self.term = TerminalController(stream or sys.stderr)
+        fmt, self.colors = _colorize(self.term, fmt, self._LEVEL_RE,
+                                     self._LEVEL_FORMAT, color)
+        self.reset = self.term.NORMAL
         super(ColorFormatter, self).__init__(fmt, *args, **kwargs)
-        self.term = TerminalController()
 
     def format(self, record):
-        record.levelcolor = ''
-        if record.levelno == logging.DEBUG:
-            record.levelcolor = "${CYAN}"
-        elif record.levelno == logging.INFO:
-            record.levelcolor = "${GREEN}"
-        elif record.levelno == logging.WARNING:
-            record.levelcolor = "${YELLOW}"
-        elif record.levelno == logging.ERROR:
-            record.levelcolor = "${RED}"
-        elif record.levelno == logging.CRITICAL:
-            record.levelcolor = "${BG_RED}"
-
-        return self.term.render(super(ColorFormatter, self).format(record))
-
-
-class NewColorFormatter(logging.Formatter):
+        if self.colors is not None:
+            record.levelcolor = self.colors.get(record.levelno, '')
+            record.levelreset = self.reset
+        return super(ColorFormatter, self).format(record)
+
+
+class NewColorFormatter(ColorFormatter):
+    """
+    ColorFormatter using str.format style formats
+    """
+    _LEVEL_RE = r'\{level(no|name).*?\}'
+    _LEVEL_FORMAT = r'{levelcolor}\g<0>{levelreset}'
+
     def __init__(self, fmt=None, *args, **kwargs):
-        if fmt:
-            fmt = re.sub(r'\{level(no|name).*?\}',
-                         r'{levelcolor}\g<0>${{NORMAL}}', fmt)
-        super(NewColorFormatter, self).__init__(fmt, style='{', *args, **kwargs)
-        self.term = TerminalController()
+        kwargs['style'] = '{'
+        super(NewColorFormatter, self).__init__(fmt, *args, **kwargs)
+
+
+#: (record attribute, key) pairs written by the JSONFormatter
+JSON_FIELDS = (
+    ('created', 'time'),
+    ('levelname', 'level'),
+    ('name', 'logger'),
+    ('message', 'message'),
+)
+
+#: attributes of every record, all others are extra fields
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | \
+    frozenset(['message', 'asctime', 'levelcolor', 'levelreset'])
+
+_encode_str = json.encoder.encode_basestring
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formatter writing records as JSON objects (one per line)
+
+    Besides `fields`, all extra attributes of a record and the formatted
+    exception and stack info are written. The keys are encoded once;
+    orjson is used if installed.
+
+    Keyword arguments:
+    fields -- (record attribute, key) pairs (Default: JSON_FIELDS)
+    extra -- write extra attributes of the records (Default: True)
+    """
+
+    def __init__(self, fmt=None, datefmt=None, fields=JSON_FIELDS, extra=True,
+                 **kwargs):
+        super(JSONFormatter, self).__init__(fmt, datefmt, **kwargs)
+        self.fields = tuple(fields)
+        self.extra = extra
+        self._keys = [_encode_str(key) + ':' for _, key in self.fields]
+        self._encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'),
+                                        default=str).encode
+
+    def _extra(self, record):
+        extra = {}
+        if self.extra:
+            for key, value in record.__dict__.items():
+                if key not in _RECORD_ATTRIBUTES:
+                    extra[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            extra['exc_info'] = record.exc_text
+        if record.stack_info:
+            extra['stack_info'] = self.formatStack(record.stack_info)
+        return extra
 
     def format(self, record):
-        record.levelcolor = ''
-        if record.levelno == logging.DEBUG:
-            record.levelcolor = "${CYAN}"
-        elif record.levelno == logging.INFO:
-            record.levelcolor = "${GREEN}"
-        elif record.levelno == logging.WARNING:
-            record.levelcolor = "${YELLOW}"
-        elif record.levelno == logging.ERROR:
-            record.levelcolor = "${RED}"
-        elif record.levelno == logging.CRITICAL:
-            record.levelcolor = "${BG_RED}"
+        record.message = record.getMessage()
+        values = [getattr(record, attribute, None)
+                  for attribute, _ in self.fields]
+        extra = self._extra(record)
+
+        if orjson is not None:
+            data = dict(zip([key for _, key in self.fields], values))
+            data.update(extra)
+            return orjson.dumps(data, default=str,
+                                option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+        encode = self._encode
+        items = [key + (_encode_str(value) if type(value) is str
+                        else encode(value))
+                 for key, value in zip(self._keys, values)]
+        for key, value in extra.items():
+            items.append(_encode_str(key) + ':' + encode(value))
+        return '{' + ','.join(items) + '}'
+
+
+#: what a BoundedQueueHandler does with records if its queue is full
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop')
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for a bounded queue
+
+    Keyword arguments:
+    queue -- queue.Queue with a maxsize
+    overflow -- if the queue is full, "block" waits for space,
+                "drop_oldest" discards the oldest queued record and "drop"
+                the new one (Default: "block")
+
+    Discarded records are counted in `dropped`.
+    """
 
-        return self.term.render(super(NewColorFormatter, self).format(record))
+    def __init__(self, queue, overflow='block'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy {!r}'.format(overflow))
+        super(BoundedQueueHandler, self).__init__(queue)
+        self.overflow = overflow
+        self.dropped = 0
+        self._drop_lock = threading.Lock()
+
+    def enqueue(self, record):
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except _queue.Full:
+                pass
+            with self._drop_lock:
+                self.dropped += 1
+                if self.overflow == 'drop':
+                    return
+                try:
+                    self.queue.get_nowait()
+                except _queue.Empty:
+                    self.dropped -= 1
+
+
+def _batch_writable(handler):
+    # StreamHandlers which don't customize emit get the batch in one write
+    emit = type(handler).emit
+    return (emit is logging.StreamHandler.emit or
+            emit is logging.FileHandler.emit) and \
+        getattr(handler, 'stream', None) is not None
+
+
+class BatchQueueListener(object):
+    """
+    Passes the records of a queue to handlers in a background thread
+
+    Like logging.handlers.QueueListener (respecting the handler levels),
+    but all records available are handled as batch: StreamHandlers get
+    the formatted batch in a single write. Records dropped by
+    `queue_handler` are reported as warning.
+
+    Keyword arguments:
+    queue -- queue the records are read from
+    *handlers -- handlers of the records
+    batch_size -- maximal number of records per batch (Default: 256)
+    queue_handler -- BoundedQueueHandler whose drops are reported
+    """
+    _sentinel = None
+
+    def __init__(self, queue, *handlers, **kwargs):
+        self.queue = queue
+        self.handlers = handlers
+        self.batch_size = kwargs.pop('batch_size', 256)
+        self.queue_handler = kwargs.pop('queue_handler', None)
+        if kwargs:
+            raise TypeError('Unexpected arguments {}'.format(', '.join(kwargs)))
+        self.reported_drops = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='BatchQueueListener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Handles all queued records and stops the thread
+        """
+        if self._thread is not None:
+            self.queue.put(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+    def _monitor(self):
+        get, get_nowait = self.queue.get, self.queue.get_nowait
+        running = True
+        while running:
+            records = [get()]
+            while len(records) < self.batch_size:
+                try:
+                    records.append(get_nowait())
+                except _queue.Empty:
+                    break
+            if self._sentinel in records:
+                records = records[:records.index(self._sentinel)]
+                running = False
+            self.handle(records)
+
+    def _drop_record(self):
+        dropped = self.queue_handler.dropped if self.queue_handler else 0
+        if dropped == self.reported_drops:
+            return None
+        record = logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0,
+            '%d log records dropped', (dropped - self.reported_drops,), None)
+        self.reported_drops = dropped
+        return record
+
+    def handle(self, records):
+        """
+        Passes a batch of records to the handlers
+        """
+        record = self._drop_record()
+        if record is not None:
+            records.append(record)
+        for handler in self.handlers:
+            accepted = [record for record in records
+                        if record.levelno >= handler.level and
+                        handler.filter(record)]
+            if not accepted:
+                continue
+            if not _batch_writable(handler):
+                for record in accepted:
+                    handler.handle(record)
+                continue
+            lines = []
+            for record in accepted:
+                try:
+                    lines.append(handler.format(record) + handler.terminator)
+                except Exception:
+                    handler.handleError(record)
+            if not lines:
+                continue
+            try:
+                handler.acquire()
+                try:
+                    handler.stream.write(''.join(lines))
+                    handler.flush()
+                finally:
+                    handler.release()
+            except Exception:
+                handler.handleError(accepted[-1])
+
+
+def queue_logging(logger=None, queue_size=10000, overflow='block',
+                  batch_size=256):
+    """
+    Moves the handlers of a logger (Default: root) behind a queue, so
+    logging calls don't block on the output. The handlers are served by
+    a BatchQueueListener, which is stopped (and flushed) at exit.
+
+    Keyword arguments:
+    logger -- logger whose handlers are moved (Default: root logger)
+    queue_size -- maximal number of queued records, 0 for unbounded
+    overflow -- policy if the queue is full (see BoundedQueueHandler)
+    batch_size -- maximal number of records written at once
+    """
+    logger = logger or logging.getLogger()
+    records = _queue.Queue(queue_size)
+    handler = BoundedQueueHandler(records, overflow)
+    listener = BatchQueueListener(records, *logger.handlers,
+                                  batch_size=batch_size, queue_handler=handler)
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
 
 def load_config(filename="logging.ini", *args, **kwargs):
@@ -70,13 +354,21 @@ def load_config(filename="logging.ini", *args, **kwargs):
     logging.config.fileConfig(filename, *args, **kwargs)
 
 
-def default_config(level=logging.INFO, auto_init=True, new_formatter=False, **kwargs):
+def default_config(level=logging.INFO, auto_init=True, new_formatter=False,
+                   queue=False, queue_size=10000, overflow='block',
+                   json_file=None, **kwargs):
     """
     Returns the default config dictionary and inits the logging system if requested
     
     Keyword arguments:
     level -- loglevel of the console handler (Default: logging.INFO)
     auto_init -- initialize the logging system with the provided config (Default: True)
+    queue -- log through a queue and write in a background thread, only
+             applied with auto_init (see queue_logging) (Default: False)
+    queue_size -- maximal number of queued records (Default: 10000)
+    overflow -- "block", "drop_oldest" or "drop" if the queue is full
+    json_file -- additionally write the records as JSON lines to this
+                 file (see JSONFormatter) (Default: None)
     **kwargs -- additional options for the logging system
     
     """
@@ -117,10 +409,25 @@ def default_config(level=logging.INFO, auto_init=True, new_formatter=False, **kw
             }
         }
 
+    if json_file:
+        formatters['json'] = {
+            '()': __name__ + '.JSONFormatter',
+        }
+        options['handlers']['json'] = {
+            'class': 'logging.FileHandler',
+            'formatter': 'json',
+            'level': level,
+            'filename': json_file,
+            'encoding': 'utf-8',
+        }
+        options['root']['handlers'].append('json')
+
     options.update(kwargs)
 
     if auto_init:
         logging.config.dictConfig(options)
+        if queue:
+            queue_logging(queue_size=queue_size, overflow=overflow)
     return options
 
 
@@ -140,33 +447,102 @@ def scope_logger(cls):
     return cls
 
 
-class LogPipe(threading.Thread):
+class _PipeLogger(object):
+    """
+    Pipe whose output is logged line by line, see LogPipe
+    """
 
-    def __init__(self, level):
-        """Setup the object with a logger and a loglevel
-        and start the thread
-        """
-        super(LogPipe, self).__init__(name='LogPipe')
-        self.daemon = False
+    def __init__(self, level, logger=None, encoding='utf-8', errors='replace',
+                 chunk_size=65536, rate_limit=None, sample=1, tail=0):
         self.level = logging._checkLevel(level)
+        self.logger = logging.getLogger(logger)
+        self.encoding = encoding
+        self.errors = errors
+        self.chunk_size = chunk_size
+        self.rate_limit = rate_limit
+        self.sample = sample
+        self.tail = collections.deque(maxlen=tail) if tail else None
+        self.lines = 0      #: number of lines read
+        self.bytes = 0      #: number of bytes read
+        self.suppressed = 0 #: number of lines not logged due to rate_limit
+        self._pending_suppressed = 0
+        self._window_end = 0
+        self._window_left = 0
+        self._partial = b''
         self.fdRead, self.fdWrite = os.pipe()
-        self.pipeReader = os.fdopen(self.fdRead)
         self._finished = threading.Event()
-        self.start()
 
     def fileno(self):
         """Return the write file descriptor of the pipe
         """
         return self.fdWrite
 
-    def run(self):
-        """Run the thread, logging everything.
+    def _decode(self, line):
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        try:
+            return line.decode(self.encoding, self.errors)
+        except UnicodeDecodeError:
+            return line.decode(self.encoding, 'backslashreplace')
+
+    def _limit(self, lines):
+        now = time.time()
+        if now >= self._window_end:
+            self._report_suppressed()
+            self._window_end = now + 1.0
+            self._window_left = self.rate_limit
+        allowed = lines[:self._window_left]
+        self._window_left -= len(allowed)
+        self._pending_suppressed += len(lines) - len(allowed)
+        return allowed
+
+    def _report_suppressed(self):
+        if self._pending_suppressed:
+            self.suppressed += self._pending_suppressed
+            self._log(['%d lines suppressed' % self._pending_suppressed])
+            self._pending_suppressed = 0
+
+    def _log(self, lines):
+        logger = self.logger
+        if not logger.isEnabledFor(self.level):
+            return
+        make_record, handle = logger.makeRecord, logger.handle
+        for line in lines:
+            handle(make_record(logger.name, self.level, '<pipe>', 0, line,
+                               None, None))
+
+    def _emit(self, raw_lines):
+        first = self.lines
+        self.lines += len(raw_lines)
+        if self.tail is not None:
+            self.tail.extend([self._decode(line)
+                              for line in raw_lines[-self.tail.maxlen:]])
+        if self.sample > 1:
+            # keep the lines whose number is a multiple of sample
+            raw_lines = raw_lines[(-first) % self.sample::self.sample]
+        lines = [self._decode(line) for line in raw_lines]
+        if self.rate_limit is not None:
+            lines = self._limit(lines)
+        self._log(lines)
+
+    def feed(self, chunk):
+        """Log the complete lines of a chunk read from the pipe
         """
-        self._finished.clear()
-        for line in iter(self.pipeReader.readline, ''):
-            logging.log(self.level, line.strip('\n'))
+        self.bytes += len(chunk)
+        lines = (self._partial + chunk).split(b'\n')
+        self._partial = lines.pop()
+        if lines:
+            self._emit(lines)
+
+    def finish(self):
+        """Log the remaining output and close the read end of the pipe
+        """
+        if self._partial:
+            self._emit([self._partial])
+            self._partial = b''
+        self._report_suppressed()
 
-        self.pipeReader.close()
+        os.close(self.fdRead)
         self._finished.set()
 
     def close(self):
@@ -181,7 +557,178 @@ class LogPipe(threading.Thread):
     def __exit__(self, *args, **kwargs):
         self.close()
 
-if __name__ == '__main__':
+
+class LogPipe(_PipeLogger, threading.Thread):
+    """
+    Pipe whose output is logged line by line, e.g. as stdout of a
+    subprocess
+
+    The pipe is read in binary chunks, the complete lines of a chunk are
+    decoded and logged as batch.
+
+    Keyword arguments:
+    level -- level of the records
+    logger -- name of the logger (Default: root logger)
+    encoding -- encoding of the output (Default: "utf-8")
+    errors -- decode error policy (Default: "replace"), undecodable lines
+              are logged escaped with "strict"
+    chunk_size -- bytes read at once (Default: 65536)
+    rate_limit -- maximal lines logged per second, the number of
+                  suppressed lines is logged afterwards (Default: None)
+    sample -- log only every n-th line (Default: 1)
+    tail -- number of last lines kept in `tail` (Default: 0)
+    """
+
+    def __init__(self, level, **kwargs):
+        """Setup the object with a logger and a loglevel
+        and start the thread
+        """
+        threading.Thread.__init__(self, name='LogPipe')
+        _PipeLogger.__init__(self, level, **kwargs)
+        self.daemon = False
+        self.start()
+
+    def run(self):
+        """Run the thread, logging everything.
+        """
+        while True:
+            chunk = os.read(self.fdRead, self.chunk_size)
+            if not chunk:
+                break
+            self.feed(chunk)
+        self.finish()
+
+
+class PumpedPipe(_PipeLogger):
+    """
+    Pipe served by a LogPump, see LogPipe for the keyword arguments
+    """
+
+    def __init__(self, pump, level, **kwargs):
+        super(PumpedPipe, self).__init__(level, **kwargs)
+        self.pump = pump
+        pump._register(self)
+
+
+class LogPump(object):
+    """
+    Logs the output of many pipes from a single thread
+
+    The pipes are multiplexed with a selector, so hundreds of
+    subprocesses don't need hundreds of threads. The thread runs as
+    long as pipes are open.
+
+    Example:
+    >>> pump = LogPump()
+    >>> with pump.pipe('INFO', logger='host1') as out, \\
+    ...         pump.pipe('ERROR', logger='host1') as err:
+    ...     subprocess.check_call(cmd, stdout=out, stderr=err)
+    """
+
+    def __init__(self):
+        self.pipes = []
+        self._lock = threading.Lock()
+        self._new = []
+        self._thread = None
+        self._wakeup_read = self._wakeup_write = None
+
+    def pipe(self, level, **kwargs):
+        """
+        Returns a new PumpedPipe (see LogPipe for the keyword arguments)
+        """
+        return PumpedPipe(self, level, **kwargs)
+
+    def _register(self, pipe):
+        with self._lock:
+            self.pipes.append(pipe)
+            self._new.append(pipe)
+            if self._thread is None:
+                self._wakeup_read, self._wakeup_write = os.pipe()
+                self._thread = threading.Thread(target=self._run,
+                                                name='LogPump')
+                self._thread.daemon = True
+                self._thread.start()
+            else:
+                os.write(self._wakeup_write, b'.')
+
+    def _run(self):
+        import selectors
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_read, selectors.EVENT_READ)
+        active = 0
+        while True:
+            with self._lock:
+                for pipe in self._new:
+                    selector.register(pipe.fdRead, selectors.EVENT_READ, pipe)
+                active += len(self._new)
+                self._new = []
+                if not active:
+                    # no open pipes left, the next pipe starts a new thread
+                    selector.close()
+                    os.close(self._wakeup_read)
+                    os.close(self._wakeup_write)
+                    self._thread = None
+                    return
+            for key, _ in selector.select():
+                pipe = key.data
+                if pipe is None:
+                    os.read(self._wakeup_read, 4096)
+                    continue
+                chunk = os.read(key.fd, pipe.chunk_size)
+                if chunk:
+                    pipe.feed(chunk)
+                    continue
+                selector.unregister(key.fd)
+                active -= 1
+                with self._lock:
+                    self.pipes.remove(pipe)
+                pipe.finish()
+
+    def close(self):
+        """
+        Closes the write ends of all open pipes and waits until their
+        output is logged
+        """
+        with self._lock:
+            pipes = list(self.pipes)
+        for pipe in pipes:
+            if not pipe._finished.is_set():
+                try:
+                    pipe.close()
+                except OSError:
+                    pipe._finished.wait()
+        thread = self._thread
+        if thread is not None and not self.pipes:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+def _benchmark(count=100000):
+    import timeit
+    record = logging.LogRecord(__name__, logging.INFO, __file__, 1,
+                               'request %s took %.3fs', ('/index', 0.0123),
+                               None)
+    record.user = 'alice'
+    formatters = [
+        ('logging.Formatter', logging.Formatter(
+            '%(asctime)s [%(levelname)s] %(name)s: %(message)s')),
+        ('ColorFormatter', ColorFormatter(
+            '%(asctime)s [%(levelname)s] %(name)s: %(message)s', color=True)),
+        ('JSONFormatter', JSONFormatter()),
+    ]
+    for name, formatter in formatters:
+        seconds = min(timeit.repeat(lambda: formatter.format(record),
+                                    number=count, repeat=3))
+        print('{:<20} {:>10.0f} records/s'.format(name, count / seconds))
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['benchmark']:
+    _benchmark()
+elif __name__ == '__main__':
     default_config(logging.DEBUG)
 
     log = logging.getLogger(__name__)
@@ -1,192 +1,501 @@
 #  vim: set ts=8 sw=4 tw=0 fileencoding=utf-8 filetype=python expandtab:
 from __future__ import absolute_import, unicode_literals
 
+import io
+import json
+import logging
+import os
+import random
 import sys
+import threading
 import time
+from collections import deque
 from .exception import add_exceptionhook
-from .internal import _print
+from .internal import TERM, _print
+from .terminal import _format_duration
 
-def _trace(s):
-    _print(s, sys.stderr)
+#: seconds of progress used for rates and ETAs
+RATE_WINDOW = 5.0
+
+#: output of spinners if stderr isn't a terminal: "text" or "json" lines
+SPINNER_FORMAT = os.environ.get('HELPERLIB_SPINNER_FORMAT', 'text')
 
-def _debug(s):
+#: seconds between status summaries if stderr isn't a terminal
+SUMMARY_INTERVAL = float(os.environ.get('HELPERLIB_SPINNER_INTERVAL', 10))
+
+_log = logging.getLogger(__name__)
+
+def _trace(s):
     _print(s, sys.stderr)
 
 def _billboard(msg, step):
     return [msg[i:i+step].ljust(step, ' ') for i in range(len(msg))]
 
-
-if sys.stderr.isatty():
-    import threading
-    _spinner = None
-    _message = ''
-    _status = ''
-    _lock = threading.Lock()
-
-    class _Spinner(threading.Thread):
-        def __init__(self):
-            import random
-            threading.Thread.__init__(self)
-            self.running = True
-            self.i = 0
-            self.numlines = 0
-            self.spinner = random.choice([
-                ['/.......','./......','../.....','.../....','..../...','...../..','....../.',
-                 '.......\\','......\\.','.....\\..','....\\...','...\\....','..\\.....','.\\......'],
-                _billboard('   trollololol lololol lololol     trollolololoooool      ', 5),
-                ['|', '/', '-', '\\'],
-                ['q', 'p', 'b', 'd'],
-                ['.', 'o', 'O', '0', '*', ' ', ' ', ' '],
-                ['▁', '▃', '▄', '▅', '▆', '▇', '█', '▇', '▆', '▅', '▄', '▃'],
-                ['┤', '┘', '┴', '└', '├', '┌', '┬', '┐'],
-                ['←', '↖', '↑', '↗', '→', '↘', '↓', '↙'],
-                ['◢', '◢', '◣', '◣', '◤', '◤', '◥', '◥'],
-                ['◐', '◓', '◑', '◒'],
-                ['▖', '▘', '▝', '▗'],
-                ['.', 'o', 'O', '°', ' ', ' ', '°', 'O', 'o', '.', ' ', ' '],
-                ['<', '<', '∧', '∧', '>', '>', 'v', 'v']
-            ])
-
-        def format(self, marker, status):
-            s = '\x1b[J ' + marker + ' ' + _message
-            if status and _message:
-                s += ': '
-            lines = status.split('\n')
-            lines += [''] * (self.numlines - len(lines) - 1)
-            if len(lines) > 1:
-                if lines[0] == '':
-                    lines = lines[1:]
-                pref = '\n       '
-                s += pref
-                s += pref.join(lines)
-                self.numlines = len(lines) + 1
-            else:
-                s += status
-            return s
-
-        def update(self, only_spin = False):
-            _lock.acquire()
-            marker = "[${BOLD}${BLUE}%s${NORMAL}]" % (self.spinner[self.i],)
-            if only_spin:
-                _trace('\x1b[s ' + marker + '\x1b[u')
+def _format_amount(value, unit):
+    if unit != 'B':
+        return '%d%s' % (value, unit)
+    for prefix in ('', 'Ki', 'Mi', 'Gi', 'Ti'):
+        if abs(value) < 1024 or prefix == 'Ti':
+            break
+        value /= 1024.0
+    return ('%d%s' if not prefix else '%.1f%s') % (value, prefix + unit)
+
+def _sample_rate(samples, now, done):
+    samples.append((now, done))
+    while len(samples) > 2 and now - samples[0][0] > RATE_WINDOW:
+        samples.popleft()
+    (start, first) = samples[0]
+    return (done - first) / (now - start) if now > start else 0.0
+
+def _progress_info(progress, samples, now):
+    """
+    formats (done, total, unit) with the rate and ETA over the samples
+    of the last RATE_WINDOW seconds
+    """
+    done, total, unit = progress
+    rate = _sample_rate(samples, now, done)
+    if total:
+        info = '%s/%s (%d%%)' % (_format_amount(done, unit),
+                                 _format_amount(total, unit),
+                                 100 * done // total)
+    else:
+        info = _format_amount(done, unit)
+    info += ', %s/s' % _format_amount(rate, unit)
+    if total and rate > 0:
+        info += ', ETA ' + _format_duration(max(0, total - done) / rate)
+    return info
+
+def _log_timing(message, phases, result):
+    """
+    logs the duration of each phase (status) of a waitfor call
+    """
+    end = time.time()
+    stats = []
+    for (name, start), (_, stop) in zip(phases, phases[1:] + [(None, end)]):
+        stats.append('%s %.3fs' % (name or '-', stop - start))
+    _log.info('%s: %s after %.3fs (%s)', message, result,
+              end - phases[0][1], ', '.join(stats))
+
+
+_SPINNERS = [
+    ['/.......','./......','../.....','.../....','..../...','...../..','....../.',
+     '.......\\','......\\.','.....\\..','....\\...','...\\....','..\\.....','.\\......'],
+    _billboard('   trollololol lololol lololol     trollolololoooool      ', 5),
+    ['|', '/', '-', '\\'],
+    ['q', 'p', 'b', 'd'],
+    ['.', 'o', 'O', '0', '*', ' ', ' ', ' '],
+    ['▁', '▃', '▄', '▅', '▆', '▇', '█', '▇', '▆', '▅', '▄', '▃'],
+    ['┤', '┘', '┴', '└', '├', '┌', '┬', '┐'],
+    ['←', '↖', '↑', '↗', '→', '↘', '↓', '↙'],
+    ['◢', '◢', '◣', '◣', '◤', '◤', '◥', '◥'],
+    ['◐', '◓', '◑', '◒'],
+    ['▖', '▘', '▝', '▗'],
+    ['.', 'o', 'O', '°', ' ', ' ', '°', 'O', 'o', '.', ' ', ' '],
+    ['<', '<', '∧', '∧', '>', '>', 'v', 'v']
+]
+
+
+def _terminal_width(stream):
+    try:
+        return os.get_terminal_size(stream.fileno()).columns
+    except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def _join(thread):
+    if thread is not None and thread is not threading.current_thread():
+        thread.join()
+
+
+class SpinnerTask(object):
+    """
+    Handle of a spinner line of a SpinnerManager
+
+    status/status_append/progress only store the new values, which are
+    drawn at the next frame of the manager. Can be used as context
+    manager, which succeeds on exit or fails if an exception was raised.
+    """
+
+    def __init__(self, manager, message, parent=None, timing=False):
+        self.manager = manager
+        self.message = message
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.spinner = random.choice(_SPINNERS)
+        self.finished = False
+        self.samples = deque()
+        self.started = time.time()
+        self.phases = [('', self.started)] if timing else None
+        self._status = ''
+        self._progress = None
+
+    @property
+    def path(self):
+        if self.parent is None:
+            return self.message
+        return self.parent.path + ' > ' + self.message
+
+    def status(self, s):
+        self._status = s
+        if self.phases is not None:
+            self.phases.append((s, time.time()))
+
+    def status_append(self, s):
+        self._status += s
+
+    def progress(self, done, total=None, unit=''):
+        """
+        Reports numeric progress (e.g. items or bytes with unit 'B'),
+        shown with rate and ETA at the next frame
+        """
+        self._progress = (done, total, unit)
+
+    def waitfor(self, s, timing=False):
+        """
+        Starts a nested spinner below this one
+        """
+        return self.manager.waitfor(s, parent=self, timing=timing)
+
+    def succeeded(self, s='Done'):
+        self.manager._finish(self, 'succeeded', s)
+
+    def failed(self, s='FAILED!'):
+        self.manager._finish(self, 'failed', s)
+
+    def current_status(self):
+        status = self._status
+        if self._progress is not None:
+            info = _progress_info(self._progress, self.samples, time.time())
+            status = status + ' ' + info if status else info
+        return status
+
+    def format(self, marker, status, width=None):
+        """
+        returns the lines showing status next to marker, cut to width
+        terminal cells
+        """
+        indent = '  ' * self.depth
+        lines = status.split('\n')
+        first = self.message
+        if lines[0] and self.message:
+            first += ': '
+        first += lines[0]
+        lines = [first] + [' ' * 6 + line for line in lines[1:]]
+        if width:
+            width = max(0, width - len(indent) -
+                        TERM.visible_width(marker) - 1)
+            lines = [line[:width] for line in lines]
+        return [indent + marker + ' ' + lines[0]] + \
+            [indent + line for line in lines[1:]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.finished:
+            if exc_type is None:
+                self.succeeded()
             else:
-                s = self.format(marker, _status)
-                if self.numlines <= 1:
-                    s += '\x1b[G'
-                else:
-                    s += '\x1b[%dF' % (self.numlines - 1)
-                _trace(s)
-            _lock.release()
-
-        def finish(self, marker, status):
-            if not status:
-                _trace(marker + '\x1b[%dE\n' % self.numlines)
-            elif '\n' not in status:
-                s = '\x1b[K' + marker + ' ' + _message + ': ' + status
-                if self.numlines > 1:
-                    s += '\x1b[%dE' % (self.numlines - 1)
-                s += '\n'
-                _trace(s)
+                self.failed()
+        return False
+
+
+class SpinnerManager(object):
+    """
+    Draws the lines of all active SpinnerTasks
+
+    One render thread redraws all lines in place `1 / interval` times
+    per second with a single write. Finished tasks and text passed to
+    `write()` are printed above the active lines. Tasks report without
+    locking, the lock is only taken to draw and to add or remove tasks.
+    Only the markers and text passed to `write()` are rendered as
+    templates, messages and status are printed as they are.
+
+    Arguments:
+        stream   - output stream (default sys.stderr)
+        interval - seconds between frames (default 0.1)
+    """
+
+    MARKERS = {
+        'succeeded': '[${BOLD}${GREEN}+${NORMAL}]',
+        'failed': '[${BOLD}${RED}-${NORMAL}]',
+    }
+
+    def __init__(self, stream=None, interval=0.1):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.tasks = []
+        self.tick = 0
+        self._output = []
+        self._drawn = 0
+        self._lock = threading.RLock()
+        self._thread = None
+        self._wakeup = None
+
+    def waitfor(self, message, parent=None, timing=False):
+        """
+        Adds a spinner line and returns its SpinnerTask
+        """
+        task = SpinnerTask(self, message, parent, timing)
+        with self._lock:
+            if parent is not None and parent in self.tasks:
+                # below the parent and its active children
+                index = self.tasks.index(parent) + 1
+                while index < len(self.tasks) and \
+                        self.tasks[index].depth > parent.depth:
+                    index += 1
+                self.tasks.insert(index, task)
             else:
-                _trace(self.format(marker, status) + '\n')
-            _trace('\x1b[?25h')
-
-        def run(self):
-            global _marker
-            while True:
-                if self.running:
-                    self.update(True)
-                else:
+                self.tasks.append(task)
+            if self._thread is None:
+                self._wakeup = threading.Event()
+                self._thread = threading.Thread(target=self._run,
+                                                args=(self._wakeup,))
+                self._thread.daemon = True
+                self._thread.start()
+            self.render()
+        return task
+
+    def write(self, text):
+        """
+        Prints text above the active spinners
+        """
+        # rendered here, so invalid templates fail in the caller
+        self._write(TERM.render(text))
+
+    def _write(self, text):
+        with self._lock:
+            if not self.tasks:
+                self.stream.write(text)
+                self.stream.flush()
+                return
+            if not text.endswith('\n'):
+                text += '\n'
+            self._output.append(text)
+            self.render()
+
+    def _result(self, task, result, status):
+        return '\n'.join(task.format(TERM.bind(self.MARKERS[result]),
+                                     status)) + '\n'
+
+    def _finish(self, task, result, status):
+        with self._lock:
+            if task.finished:
+                return
+            task.finished = True
+            self.tasks.remove(task)
+            self._output.append(self._result(task, result, status))
+            self.render()
+            thread = self._stop() if not self.tasks else None
+        _join(thread)
+        if task.phases is not None:
+            _log_timing(task.message, task.phases, status)
+
+    def abort(self):
+        """
+        Removes all spinners without printing a result
+        """
+        with self._lock:
+            for task in self.tasks:
+                task.finished = True
+            self.tasks = []
+            self.render()
+            thread = self._stop()
+        _join(thread)
+
+    def _stop(self):
+        # called with the lock held, the returned thread has to be
+        # joined after releasing it
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._wakeup.set()
+        return thread
+
+    def render(self):
+        """
+        Redraws all active lines (and prints pending output above them)
+        """
+        with self._lock:
+            out = []
+            if self._drawn:
+                out.append('\x1b[%dF' % self._drawn)
+            out.extend('\x1b[K' + text for text in self._output)
+            self._output = []
+            width = _terminal_width(self.stream)
+            lines = []
+            for task in self.tasks:
+                marker = TERM.bind("[${BOLD}${BLUE}%s${NORMAL}]" % (
+                    task.spinner[self.tick % len(task.spinner)],))
+                # every line starts with a space
+                lines.extend(task.format(marker, task.current_status(),
+                                         width and width - 1))
+            out.extend(' \x1b[K' + line + '\n' for line in lines)
+            out.append('\x1b[J' + ('\x1b[?25l' if lines else '\x1b[?25h'))
+            self._drawn = len(lines)
+            self.stream.write(''.join(out))
+            self.stream.flush()
+
+    def _run(self, wakeup):
+        while not wakeup.wait(self.interval):
+            with self._lock:
+                if wakeup.is_set():
                     break
-                self.i = (self.i + 1) % len(self.spinner)
-                time.sleep(0.1)
-
-    def _stop_spinner(marker = '[${BOLD}${BLUE}*${NORMAL}]', status = ''):
-        global _spinner, _status
-
-        if _spinner is None:
-            return
+                self._frame()
+
+    def _frame(self):
+        self.tick += 1
+        self.render()
+
+
+class PlainSpinnerManager(SpinnerManager):
+    """
+    SpinnerManager for streams which aren't terminals
+
+    Nothing is animated: tasks are reported when they start and finish,
+    changes of their status and progress are coalesced into one summary
+    line per task every `interval` seconds. With json every line is a
+    JSON object with timestamp, event and elapsed seconds of the task.
+
+    Arguments:
+        stream   - output stream (default sys.stderr)
+        interval - seconds between summaries (default 10)
+        json     - write JSON lines instead of text (default False)
+    """
+    MARKERS = {'status': '[*]', 'succeeded': '[+]', 'failed': '[-]'}
+
+    def __init__(self, stream=None, interval=10.0, json=False):
+        super(PlainSpinnerManager, self).__init__(stream, interval)
+        self.json = json
+        self._reported = {}
+
+    def _line(self, task, event, status):
+        now = time.time()
+        elapsed = now - task.started
+        if not self.json:
+            if event == 'start':
+                return '[*] %s\n' % (task.path,)
+            return '%s %s: %s (%.1fs)\n' % (self.MARKERS[event], task.path,
+                                             status, elapsed)
+        record = {'time': round(now, 3), 'event': event, 'task': task.path,
+                  'elapsed': round(elapsed, 3)}
+        if status:
+            record['status'] = status
+        if task._progress is not None:
+            done, total, unit = task._progress
+            record.update(done=done, total=total, unit=unit,
+                          rate=round(_sample_rate(task.samples, now, done), 3))
+        return json.dumps(record) + '\n'
+
+    def write(self, text):
+        if not self.json:
+            return super(PlainSpinnerManager, self).write(text)
+        self._write(json.dumps({'time': round(time.time(), 3),
+                                'event': 'message',
+                                'message': text.rstrip('\n')}) + '\n')
+
+    def _result(self, task, result, status):
+        self._reported.pop(task, None)
+        return self._line(task, result, status)
+
+    def _frame(self):
+        for task in self.tasks:
+            state = (task._status, task._progress)
+            if self._reported.get(task, state) != state:
+                self._reported[task] = state
+                status = task._status if self.json else task.current_status()
+                self._output.append(self._line(task, 'status', status))
+        self.render()
+
+    def render(self):
+        with self._lock:
+            out, self._output = self._output, []
+            for task in self.tasks:
+                if task not in self._reported:
+                    self._reported[task] = (task._status, task._progress)
+                    out.append(self._line(task, 'start', ''))
+            if out:
+                self.stream.write(''.join(out))
+                self.stream.flush()
+
+    def abort(self):
+        with self._lock:
+            self._reported.clear()
+        super(PlainSpinnerManager, self).abort()
 
-        _spinner.running = False
-        _spinner.join()
-        _spinner.finish(marker, status)
-        _spinner = None
-
-    def _hook(*args):
-        global _spinner
-        _stop_spinner('')
-        _trace('${BOLD}${YELLOW}[!]${NORMAL} BOOOM\n')
-
-    add_exceptionhook(_hook) # reset, show cursor
-
-    def _start_spinner():
-        global _spinner
-        _stop_spinner()
-        _spinner = _Spinner()
-        _spinner.update()
-        _spinner.daemon = True
-        _spinner.start()
-
-    def trace(s):
-        _stop_spinner()
-        _trace(s)
-
-    def debug(s):
-        _stop_spinner()
-        _debug(s)
-
-    def waitfor(s):
-        global _message, _status
-        if _spinner is not None:
-            raise Exception('waitfor has already been called')
-        _status = ''
-        _message = s
-        _start_spinner()
-
-    def status(s):
-        global _status
-        if _spinner is None:
-            raise Exception('waitfor has not been called')
-        _lock.acquire()
-        _status = s
-        _lock.release()
-        _spinner.update()
-
-    def status_append(s):
-        global _status
-        if _spinner is None:
-            raise Exception('waitfor has not been called')
-        _lock.acquire()
-        _status += s
-        _lock.release()
-        _spinner.update()
-
-    def succeeded(s = 'Done'):
-        _stop_spinner('[${BOLD}${GREEN}+${NORMAL}]', s)
-
-    def failed(s = 'FAILED!'):
-        _stop_spinner('[${BOLD}${RED}-${NORMAL}]', s)
 
+if sys.stderr.isatty():
+    _manager = SpinnerManager(sys.stderr)
 else:
-    _message = ''
-
-    def waitfor(s):
-        global _message
-        _message = s
-        _debug(s)
+    _manager = PlainSpinnerManager(sys.stderr, SUMMARY_INTERVAL,
+                                   json=SPINNER_FORMAT == 'json')
+_local = threading.local()
+
+def _stack():
+    try:
+        stack = _local.stack
+    except AttributeError:
+        stack = _local.stack = []
+    while stack and stack[-1].finished:
+        stack.pop()
+    return stack
+
+def _current():
+    stack = _stack()
+    if stack:
+        return stack[-1]
+    # threads without own spinner (workers) report to the latest one
+    for task in reversed(list(_manager.tasks)):
+        if task.parent is None and not task.finished:
+            return task
+    raise Exception('waitfor has not been called')
+
+def _hook(*args):
+    _manager.abort()
+    _trace('${BOLD}${YELLOW}[!]${NORMAL} BOOOM\n')
 
-    def status(s):
-        status(s, stream=sys.stderr)
-
-    def status_append(s):
-        status(s, stream=sys.stderr)
-
-    def succeeded(s = 'Done'):
-        success(s, stream=sys.stderr)
-
-    def failed(s = 'FAILED!'):
-        fail(s, stream=sys.stderr)
+if sys.stderr.isatty():
+    add_exceptionhook(_hook) # reset, show cursor
 
+def trace(s):
+    _manager.write(s)
+
+def debug(s):
+    _manager.write(s)
+
+def waitfor(s, timing=False):
+    """
+    Shows a spinner with message s until succeeded or failed is
+    called and returns its SpinnerTask. Nested calls (in the same
+    thread) show their spinner below the current one, calls from
+    other threads get their own line. Threads without a spinner of
+    their own report status and progress to the latest top-level
+    spinner. With timing, the duration of every status (phase) is
+    logged when it finishes.
+    """
+    stack = _stack()
+    task = _manager.waitfor(s, parent=stack[-1] if stack else None,
+                            timing=timing)
+    stack.append(task)
+    return task
+
+def status(s):
+    _current().status(s)
+
+def status_append(s):
+    _current().status_append(s)
+
+def progress(done, total=None, unit=''):
+    """
+    Reports numeric progress (e.g. items or bytes with unit 'B'),
+    shown with rate and ETA at the next tick of the spinner
+    """
+    _current().progress(done, total, unit)
+
+def succeeded(s = 'Done'):
+    _current().succeeded(s)
+
+def failed(s = 'FAILED!'):
+    _current().failed(s)
 
 if __name__ == '__main__':
     waitfor("Waiting...")
@@ -1,5 +1,48 @@
 from __future__ import unicode_literals, absolute_import
-import sys, re
+import sys, re, os, json, threading, time, unicodedata
+from collections import deque
+
+from six.moves import queue
+
+try:
+    from functools import lru_cache
+except ImportError:
+    def lru_cache(maxsize=128):
+        """
+        Python 2 replacement of functools.lru_cache, which simply starts
+        over once maxsize results are cached
+        """
+        def decorator(func):
+            cache = {}
+
+            def wrapper(*args):
+                try:
+                    return cache[args]
+                except KeyError:
+                    pass
+                if len(cache) >= maxsize:
+                    cache.clear()
+                result = cache[args] = func(*args)
+                return result
+            wrapper.__doc__ = func.__doc__
+            wrapper.__name__ = func.__name__
+            wrapper.cache_clear = cache.clear
+            return wrapper
+        return decorator
+
+#: directory used to persist probed terminal capabilities between
+#: processes (keyed by $TERM and the mtime of the terminfo file),
+#: disabled if None
+TERMINFO_CACHE = os.environ.get('HELPERLIB_TERMINFO_CACHE')
+
+_TERMINFO_DIRS = ['/etc/terminfo', '/lib/terminfo', '/usr/share/terminfo',
+                  '/usr/lib/terminfo']
+
+#: probed capabilities by (TERM, fd), shared by all TerminalControllers
+_capabilities = {}
+_capabilities_lock = threading.Lock()
+
+_clock = getattr(time, 'monotonic', time.time)
 
 
 def _nonempty(value):
@@ -18,6 +61,211 @@ def _tigetstr(cap_name):
     return re.sub(r'\$<\d+>[/*]?', '', cap)
 
 
+def _terminfo_file(term):
+    dirs = [os.environ.get('TERMINFO'), os.path.expanduser('~/.terminfo')]
+    dirs += os.environ.get('TERMINFO_DIRS', '').split(':') + _TERMINFO_DIRS
+    for directory in dirs:
+        if not directory:
+            continue
+        for sub in (term[0], '{:02x}'.format(ord(term[0]))):
+            path = os.path.join(directory, sub, term)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def _cache_file(term):
+    # $TERM is not trusted, keep it from leaving TERMINFO_CACHE. Names
+    # mapped to the same file only miss the cache as their key differs.
+    return os.path.join(TERMINFO_CACHE,
+                        re.sub(r'[^A-Za-z0-9.+-]', '_', term) + '.json')
+
+
+def _load_capabilities(term):
+    """
+    returns the capabilities persisted in TERMINFO_CACHE (or None) and
+    the key they have to match
+    """
+    terminfo = _terminfo_file(term)
+    if terminfo is None:
+        return None, None
+    key = '{}:{}'.format(terminfo, os.stat(terminfo).st_mtime)
+    try:
+        with open(_cache_file(term)) as fp:
+            data = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None, key
+    if data.get('key') != key:
+        return None, key
+    return data.get('capabilities'), key
+
+
+def _store_capabilities(term, key, capabilities):
+    path = _cache_file(term)
+    tmp = '{}.{}'.format(path, os.getpid())
+    try:
+        if not os.path.isdir(TERMINFO_CACHE):
+            os.makedirs(TERMINFO_CACHE)
+        with open(tmp, 'w') as fp:
+            json.dump({'key': key, 'capabilities': capabilities}, fp)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def _probe(fd):
+    """
+    returns the capabilities of the terminal as dict of
+    TerminalController attributes (empty if unknown)
+    """
+    # Curses isn't available on all platforms
+    try:
+        import curses
+    except ImportError:
+        return {}
+
+    # Check the terminal type.  If we fail, then assume that the
+    # terminal has no capabilities.
+    try:
+        if fd is None:
+            curses.setupterm()
+        else:
+            curses.setupterm(fd=fd)
+    except:
+        return {}
+
+    capabilities = {}
+
+    # Look up numeric capabilities.
+    capabilities['COLS'] = curses.tigetnum('cols')
+    capabilities['LINES'] = curses.tigetnum('lines')
+
+    # Look up string capabilities.
+    for capability in TerminalController._STRING_CAPABILITIES:
+        (attrib, cap_name) = capability.split('=')
+        capabilities[attrib] = _tigetstr(cap_name)
+
+    # Colors
+    colors = TerminalController._COLORS
+    ansicolors = TerminalController._ANSICOLORS
+    set_fg = _tigetstr('setf')
+    if set_fg:
+        for i, color in zip(range(len(colors)), colors):
+            capabilities[color] = _nonempty(curses.tparm(set_fg.encode(), i))
+    set_fg_ansi = _tigetstr('setaf')
+    if set_fg_ansi:
+        for i, color in zip(range(len(ansicolors)), ansicolors):
+            capabilities[color] = _nonempty(curses.tparm(
+                set_fg_ansi.encode(), i))
+    set_bg = _tigetstr('setb')
+    if set_bg:
+        for i, color in zip(range(len(colors)), colors):
+            capabilities['BG_'+color] = _nonempty(curses.tparm(
+                set_bg.encode(), i))
+    set_bg_ansi = _tigetstr('setab')
+    if set_bg_ansi:
+        for i, color in zip(range(len(ansicolors)), ansicolors):
+            capabilities['BG_'+color] = _nonempty(curses.tparm(
+                set_bg_ansi.encode(), i))
+    return capabilities
+
+
+def _get_capabilities(fd):
+    """
+    returns the capabilities for the current $TERM and fd, probing the
+    terminal only once per process (and TERMINFO_CACHE)
+    """
+    term = os.environ.get('TERM', '')
+    key = (term, fd)
+    try:
+        return _capabilities[key]
+    except KeyError:
+        pass
+
+    with _capabilities_lock:
+        if key in _capabilities:
+            return _capabilities[key]
+        capabilities = disk_key = None
+        if TERMINFO_CACHE and term:
+            capabilities, disk_key = _load_capabilities(term)
+        if capabilities is None:
+            capabilities = _probe(fd)
+            if disk_key and capabilities:
+                _store_capabilities(term, disk_key, capabilities)
+        _capabilities[key] = capabilities
+    return capabilities
+
+
+_TEMPLATE_RE = re.compile(r'(\$\$)|\$\{(\w+)\}')
+
+#: number of templates compile_template and TerminalController.bind keep
+_TEMPLATE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=_TEMPLATE_CACHE_SIZE)
+def compile_template(template):
+    """
+    Splits a template into literal text and capability names.
+    Returns a tuple whose even items are literals and whose odd items
+    are capability names.
+    """
+    parts = ['']
+    pos = 0
+    for match in _TEMPLATE_RE.finditer(template):
+        parts[-1] += template[pos:match.start()]
+        if match.group(1):
+            parts[-1] += match.group(1)
+        else:
+            parts.append(match.group(2))
+            parts.append('')
+        pos = match.end()
+    parts[-1] += template[pos:]
+    return tuple(parts)
+
+
+#: generic ANSI control sequence (CSI)
+_CSI = r'\x1b\[[0-?]*[ -/]*[@-~]'
+_ctrl_patterns = {}
+
+
+def _ctrl_pattern(sequences):
+    """
+    returns a (cached) regex matching any of the given control sequences
+    or a generic CSI sequence
+    """
+    key = tuple(sorted(set(s for s in sequences if s), key=len, reverse=True))
+    try:
+        return _ctrl_patterns[key]
+    except KeyError:
+        pattern = _ctrl_patterns[key] = re.compile(
+            '|'.join([re.escape(s) for s in key] + [_CSI]))
+        return pattern
+
+
+def visible_width(string):
+    """
+    Returns the number of terminal cells needed to display string
+    (without control sequences). East asian wide characters take two
+    cells, combining characters none.
+    """
+    if _isascii(string):
+        return len(string)
+    width = 0
+    for char in string:
+        if unicodedata.combining(char) or \
+                unicodedata.category(char) in ('Mn', 'Me', 'Cf'):
+            continue
+        width += 2 if unicodedata.east_asian_width(char) in 'WF' else 1
+    return width
+
+
+if hasattr(str, 'isascii'):
+    _isascii = str.isascii
+else:
+    def _isascii(string):
+        return not re.search(r'[^\x00-\x7f]', string)
+
+
 class TerminalController(object):
     """
     A class that can be used to portably generate formatted output to
@@ -103,54 +351,28 @@ class TerminalController(object):
         output; if this stream is not a tty, then the terminal is
         assumed to be a dumb terminal (i.e., have no capabilities).
         """
-        # Curses isn't available on all platforms
-        try:
-            import curses
-        except ImportError:
-            return
-
         # If the stream isn't a tty, then assume it has no capabilities.
         if not term_stream.isatty():
             return
 
-        # Check the terminal type.  If we fail, then assume that the
-        # terminal has no capabilities.
         try:
-            curses.setupterm()
-        except:
+            fd = term_stream.fileno()
+        except (AttributeError, ValueError, IOError):
+            fd = None
+
+        # The capability table is probed once per process and shared
+        # between all instances.
+        capabilities = _get_capabilities(fd)
+        if not capabilities:
             return
+        self.__dict__.update(capabilities)
 
-        # Look up numeric capabilities.
-        self.COLS = curses.tigetnum('cols')
-        self.LINES = curses.tigetnum('lines')
-
-        # Look up string capabilities.
-        for capability in self._STRING_CAPABILITIES:
-            (attrib, cap_name) = capability.split('=')
-            setattr(self, attrib, _tigetstr(cap_name))
-
-        # Colors
-        set_fg = _tigetstr('setf')
-        if set_fg:
-            for i, color in zip(range(len(self._COLORS)), self._COLORS):
-                setattr(self, color, _nonempty(curses.tparm(
-                    set_fg.encode(), i)))
-        set_fg_ansi = _tigetstr('setaf')
-        if set_fg_ansi:
-            for i, color in zip(range(len(self._ANSICOLORS)), self._ANSICOLORS):
-                setattr(self, color, _nonempty(curses.tparm(
-                    set_fg_ansi.encode(), i)))
-        set_bg = _tigetstr('setb')
-        if set_bg:
-            for i, color in zip(range(len(self._COLORS)), self._COLORS):
-                setattr(self, 'BG_'+color, _nonempty(curses.tparm(
-                    set_bg.encode(), i)))
-        set_bg_ansi = _tigetstr('setab')
-        if set_bg_ansi:
-            for i, color in zip(range(len(self._ANSICOLORS)),
-                               self._ANSICOLORS):
-                setattr(self, 'BG_'+color, _nonempty(curses.tparm(
-                    set_bg_ansi.encode(), i)))
+        # The size may have changed since the capabilities were probed
+        if fd is not None and hasattr(os, 'get_terminal_size'):
+            try:
+                self.COLS, self.LINES = os.get_terminal_size(fd)
+            except (OSError, ValueError):
+                pass
 
     def render(self, template):
         """
@@ -158,24 +380,54 @@ class TerminalController(object):
         the corresponding terminal control string (if it's defined) or
         '' (if it's not).
         """
-        return re.sub(r'\$\$|\${\w+}', self._render_sub, template)
+        parts = compile_template(template)
+        if len(parts) == 1:
+            return parts[0]
+        values = list(parts)
+        for i in range(1, len(parts), 2):
+            values[i] = getattr(self, parts[i])
+        return ''.join(values)
 
-    def _render_sub(self, match):
-        group = match.group()
-        if group == '$$':
-            return group
-        else:
-            return getattr(self, group[2:-1])
+    def bind(self, template):
+        """
+        Like `render()`, but caches the result on this terminal. Meant
+        for constant templates (headers, markers) rendered over and over,
+        the cache starts over once it holds 1024 templates.
+        """
+        try:
+            return self._bound[template]
+        except AttributeError:
+            self._bound = {}
+        except KeyError:
+            if len(self._bound) >= _TEMPLATE_CACHE_SIZE:
+                self._bound.clear()
+        rendered = self._bound[template] = self.render(template)
+        return rendered
+
+    def _ctrl_re(self):
+        pattern = self.__dict__.get('_ctrl_regex')
+        if pattern is None:
+            sequences = []
+            for color in self._COLORS:
+                sequences.append(getattr(self, color))
+                sequences.append(getattr(self, 'BG_'+color))
+            for capability in self._STRING_CAPABILITIES:
+                sequences.append(getattr(self, capability.split('=')[0], ''))
+            pattern = self._ctrl_regex = _ctrl_pattern(sequences)
+        return pattern
 
     def remove_ctrl_chars(self, string):
-        for color in self._COLORS:
-            string = string.replace(getattr(self, color), '')
-            string = string.replace(getattr(self, 'BG_'+color), '')
-        for capability in self._STRING_CAPABILITIES:
-            attrib = capability.split('=')[0]
-            if hasattr(self, attrib):
-                string = string.replace(getattr(self, attrib), '')
-        return string
+        """
+        Removes all control sequences of this terminal (and generic ANSI
+        escape sequences) from string in a single pass.
+        """
+        return self._ctrl_re().sub('', string)
+
+    def visible_width(self, string):
+        """
+        Returns the number of cells string occupies on the terminal.
+        """
+        return visible_width(self._ctrl_re().sub('', string))
 
 #######################################################################
 # Example use case: progress bar
@@ -191,46 +443,439 @@ class ProgressBar(object):
 
     The progress bar is colored, if the terminal supports color
     output; and adjusts to the width of the terminal.
+
+    Redraws are limited to `fps` frames per second and only the parts
+    that changed since the last frame are written, so `update()` and
+    `advance()` can be called from tight loops. The last state is
+    always drawn on completion or by `draw()`.
+
+    Arguments:
+        term   - TerminalController instance
+        header - title of the progress bar
+        fps    - maximal redraws per second (default 10, 0 for unlimited)
+        total  - number of steps counted by `advance()` (default None,
+                 required to use `advance()`)
+        stream - output stream (default sys.stdout)
     """
     BAR = '%3d%% ${GREEN}[${BOLD}%s%s${NORMAL}${GREEN}]${NORMAL}\n'
     HEADER = '${BOLD}${CYAN}%s${NORMAL}\n\n'
 
-    def __init__(self, term, header):
+    def __init__(self, term, header, fps=10, total=None, stream=None):
         self.term = term
+        self.stream = stream or sys.stdout
         self.__quirks = False
         if not (self.term.CLEAR_EOL and self.term.UP and self.term.BOL):
            # raise ValueError("Terminal isn't capable enough -- you "
            #                  "should use a simpler progress dispaly.")
-            sys.stdout.write(
+            self.stream.write(
                 self.term.render("${RED}Terminal isn't capable enough -- you "
                                  "should use a simpler progress display."
                                  "${NORMAL}"))
             self.__quirks = True
         self.width = self.term.COLS or 75
         self.bar = term.render(self.BAR)
+        self.bar_start = term.render('${GREEN}[${BOLD}')
         self.header = self.term.render(self.HEADER % header.center(self.width))
+        self.interval = 1.0 / fps if fps else 0
+        self.total = total
+        self.count = 0
+        self.percent = 0
+        self.message = ''
+        self._counted = False  #: percent is derived from count
+        self._next_frame = 0
+        self._frame = None  #: (cells, percent, message) on the screen
         self.cleared = 1 #: true if we haven't drawn the bar yet.
         self.update(0, '')
 
-    def update(self, percent, message):
+    def update(self, percent, message=None):
+        """
+        Sets the progress (0..1) and optionally the message
+        """
+        self.percent = percent
+        self._counted = False
+        if message is not None:
+            self.message = message
+        if self._frame_due() or percent >= 1:
+            self.draw()
+
+    def advance(self, step=1):
+        """
+        Counts `step` of `total` steps as done
+        """
+        if not self.total:
+            raise ValueError('advance() requires a total')
+        self.count += step
+        self._counted = True
+        if self._frame_due() or self.count >= self.total:
+            self.draw()
+
+    def _frame_due(self):
+        """
+        Returns True if the next frame should be drawn
+        """
+        now = _clock()
+        if now < self._next_frame:
+            return False
+        self._next_frame = now + self.interval
+        return True
+
+    def draw(self):
+        """
+        Writes the changes since the last frame
+        """
+        if self._counted:
+            self.percent = float(self.count) / self.total
+        width = self.width - 10
+        cells = max(0, min(width, int(width * self.percent)))
+        percent = int(100 * self.percent)
+        message = self.message
+        frame = (cells, percent, message)
         if self.cleared:
-            sys.stdout.write(self.header)
+            self.stream.write(self.header)
             self.cleared = 0
+        elif frame == self._frame:
+            return
+
         if self.__quirks:
-            sys.stdout.write("%.2f%%..." % (percent*100.0))
-        else:
-            n = int((self.width-10)*percent)
-            sys.stdout.write(
+            if percent != (self._frame and self._frame[1]):
+                self.stream.write("%.2f%%..." % (self.percent*100.0))
+        elif self._frame is None:
+            self.stream.write(
                 self.term.BOL + self.term.UP + self.term.CLEAR_EOL +
-                (self.bar % (100*percent, '='*n, '-'*(self.width-10-n))) +
+                (self.bar % (percent, '='*cells, '-'*(width-cells))) +
                 self.term.CLEAR_EOL + message.center(self.width))
+        else:
+            old_cells, old_percent, old_message = self._frame
+            parts = []
+            if cells != old_cells or percent != old_percent:
+                # rewrite the bar up to the last changed cell, the rest
+                # of the line stays as it is
+                parts.append(self.term.BOL + self.term.UP)
+                parts.append('%3d%% ' % percent)
+                if cells != old_cells:
+                    parts.append(self.bar_start + '='*cells +
+                                 '-'*(old_cells-cells) + self.term.NORMAL)
+                parts.append(self.term.BOL + self.term.DOWN)
+            if message != old_message:
+                parts.append(self.term.BOL + self.term.CLEAR_EOL +
+                             message.center(self.width))
+            self.stream.write(''.join(parts))
+        self._frame = frame
 
     def clear(self):
         if not self.cleared:
-            sys.stdout.write(self.term.BOL + self.term.CLEAR_EOL +
-                             self.term.UP + self.term.CLEAR_EOL +
-                             self.term.UP + self.term.CLEAR_EOL)
+            self.stream.write(self.term.BOL + self.term.CLEAR_EOL +
+                              self.term.UP + self.term.CLEAR_EOL +
+                              self.term.UP + self.term.CLEAR_EOL)
             self.cleared = 1
+            self._frame = None
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+class ProgressTask(object):
+    """
+    Handle of a task shown by a ProgressManager
+
+    `advance()` may be called from any thread; every thread counts in
+    its own slot, which is only summed up by the render thread, so
+    reporting needs neither locks nor atomic operations.
+    """
+
+    def __init__(self, id, name, total=None):
+        self.id = id
+        self.name = name
+        self.total = total
+        self.finished = False
+        #: (time, done) samples within the rate window
+        self.samples = deque()
+        self._slots = []
+        self._local = threading.local()
+        self._remote = 0
+
+    def advance(self, step=1):
+        """
+        Counts `step` units of work as done
+        """
+        try:
+            self._local.slot[0] += step
+        except AttributeError:
+            self._local.slot = [step]
+            self._slots.append(self._local.slot)
+
+    def finish(self):
+        self.finished = True
+
+    @property
+    def done(self):
+        return sum(slot[0] for slot in list(self._slots)) + self._remote
+
+    def _sample(self, now, window):
+        samples = self.samples
+        samples.append((now, self.done))
+        while len(samples) > 2 and now - samples[0][0] > window:
+            samples.popleft()
+
+    @property
+    def rate(self):
+        """
+        Units per second within the sliding window
+        """
+        if len(self.samples) < 2:
+            return 0.0
+        (start, first), (end, last) = self.samples[0], self.samples[-1]
+        return (last - first) / (end - start) if end > start else 0.0
+
+    @property
+    def eta(self):
+        """
+        Estimated remaining seconds (None if unknown)
+        """
+        rate = self.rate
+        if not self.total or not rate:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+
+class RemoteProgress(object):
+    """
+    Reports the progress of a ProgressTask from a child process
+
+    Steps are accumulated locally and sent to the manager at most once
+    per `interval` seconds. Has to be passed to the child process when
+    it is created (e.g. as argument of Process or the initializer of a
+    Pool), call `close()` before the child exits.
+    """
+
+    def __init__(self, queue, task_id, interval=0.1):
+        self.queue = queue
+        self.task_id = task_id
+        self.interval = interval
+        self.pending = 0
+        self._next_send = 0
+
+    def advance(self, step=1):
+        self.pending += step
+        now = _clock()
+        if now >= self._next_send:
+            self._next_send = now + self.interval
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.queue.put((self.task_id, self.pending))
+            self.pending = 0
+
+    close = flush
+
+
+class ProgressManager(object):
+    """
+    Shows the progress of multiple tasks, one line per task
+
+    All output is done by one render thread, `fps` times per second.
+    Workers only increment counters (see ProgressTask and
+    RemoteProgress). Rates and ETAs are computed over the last `window`
+    seconds.
+
+    Arguments:
+        term   - TerminalController instance
+        fps    - redraws per second (default 10)
+        window - seconds used for rates and ETAs (default 10)
+        stream - output stream (default sys.stdout)
+
+    Example:
+        >>> with ProgressManager(term) as progress:
+        ...     task = progress.add_task('download', total=len(urls))
+        ...     pool.map(lambda url: (fetch(url), task.advance()), urls)
+    """
+    LINE = '{name} {percent:3d}% ${GREEN}[${BOLD}{bar}${NORMAL}${GREEN}]' \
+           '${NORMAL} {info}'
+    INFO = '{done}/{total} {rate:.1f}/s ETA {eta}'
+    UNBOUNDED_INFO = '{done} {rate:.1f}/s'
+
+    def __init__(self, term, fps=10, window=10.0, stream=None):
+        self.term = term
+        self.interval = 1.0 / fps
+        self.window = window
+        self.stream = stream or sys.stdout
+        self.tasks = []
+        self.line = term.render(self.LINE)
+        self._capable = bool(term.BOL and term.UP and term.CLEAR_EOL)
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._drawn = 0
+
+    def add_task(self, name, total=None):
+        """
+        Adds a task and returns its ProgressTask handle
+        """
+        task = ProgressTask(len(self.tasks), name, total)
+        self.tasks.append(task)
+        return task
+
+    def remote(self, task, interval=0.1):
+        """
+        Returns a RemoteProgress reporting to task from a child process
+        """
+        if self._queue is None:
+            import multiprocessing
+            self._queue = multiprocessing.Queue()
+        return RemoteProgress(self._queue, task.id, interval)
+
+    def _collect(self):
+        if self._queue is not None:
+            while True:
+                try:
+                    task_id, step = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.tasks[task_id]._remote += step
+        now = _clock()
+        for task in self.tasks:
+            task._sample(now, self.window)
+
+    def _format(self, task, name_width):
+        done, total = task.done, task.total
+        if total:
+            eta = task.eta
+            info = self.INFO.format(
+                done=done, total=total, rate=task.rate,
+                eta='-:--:--' if eta is None else _format_duration(eta))
+            fraction = min(1.0, float(done) / total)
+        else:
+            info = self.UNBOUNDED_INFO.format(done=done, rate=task.rate)
+            fraction = 1.0 if task.finished else 0.0
+        width = max(10, (self.term.COLS or 75) - name_width - len(info) - 9)
+        cells = int(width * fraction)
+        return self.line.format(
+            name=task.name[:name_width].ljust(name_width),
+            percent=int(100 * fraction), bar='=' * cells + '-' * (width - cells),
+            info=info)
+
+    def render(self):
+        """
+        Returns the lines of all tasks
+        """
+        tasks = list(self.tasks)
+        name_width = min(20, max([len(task.name) for task in tasks] or [0]))
+        return [self._format(task, name_width) for task in tasks]
+
+    def draw(self):
+        lines = self.render()
+        output = [self.term.BOL + self.term.UP * self._drawn]
+        for line in lines:
+            output.append(line + self.term.CLEAR_EOL + '\n')
+        self._drawn = len(lines)
+        self.stream.write(''.join(output))
+        self.stream.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._collect()
+            self.draw()
+
+    def start(self):
+        """
+        Starts the render thread
+        """
+        if self._capable and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name='ProgressManager')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the render thread and draws the final state
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self._collect()
+        if self._capable:
+            self.draw()
+        else:
+            self.stream.write(''.join(line + '\n' for line in self.render()))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.stop()
+
+
+if sys.version_info >= (3, 0, 0):
+    _text = str
+else:
+    _text = unicode
+
+
+def _format_row(term, row, col_format, col_width, seperator, borders,
+                cur_width):
+    parts = []
+    if borders:
+        parts.append("| ")
+    for i, col in zip(range(0, len(row)), row):
+        # account for control sequences and wide characters
+        width = col_width[i] + len(col) - term.visible_width(col)
+        if col_format[i] == "c":
+            parts.append(col.center(width))
+        elif col_format[i] == "l":
+            parts.append(col.ljust(width))
+        elif col_format[i] == "r":
+            parts.append(col.rjust(width))
+
+        if i < len(row) - 1:
+            parts.append(seperator)
+
+    for i in range(len(row), len(col_format)):
+        parts.append(' ' * (col_width[i]))
+        if i < len(row) - 1:
+            parts.append(seperator)
+
+    if borders:
+        parts.append(" |\n")
+        parts.append("-"*cur_width)
+
+    parts.append("\n")
+    return ''.join(parts)
+
+
+def _clip(term, line, width):
+    """
+    Cuts line (without line break) to width terminal cells, control
+    sequences are kept so colors are still reset
+    """
+    if term.visible_width(line) <= width:
+        return line
+    parts = []
+
+    def text(string, width):
+        for i, char in enumerate(string):
+            width -= visible_width(char)
+            if width < 0:
+                parts.append(string[:i])
+                return 0
+        parts.append(string)
+        return width
+
+    pos = 0
+    for match in term._ctrl_re().finditer(line):
+        width = text(line[pos:match.start()], width)
+        parts.append(match.group())
+        pos = match.end()
+    text(line[pos:], width)
+    return ''.join(parts)
+
 
 class Table(object):
     """
@@ -248,18 +893,16 @@ class Table(object):
 
     def __init__(self, term, rows, col_format, seperator=" ", borders=False):
         self.term = term
-        if sys.version_info >= (3, 0, 0):
-            self.rows = [[ str(c) for c in r] for r in rows]
-        else:
-            self.rows = [[ unicode(c) for c in r] for r in rows]
+        self.rows = [[ _text(c) for c in r] for r in rows]
         self.col_format = col_format
         self.seperator = seperator
         self.borders = borders
-        self.col_width = [ max([ len(
-                                    self.term.remove_ctrl_chars(d[i])
-                                 ) if i < len(d) else 0
-                                for d in self.rows ]) for i in
-                                    range(0, len(self.col_format))]
+        self.col_width = [0] * len(self.col_format)
+        for row in self.rows:
+            for i, col in enumerate(row[:len(self.col_format)]):
+                width = self.term.visible_width(col)
+                if width > self.col_width[i]:
+                    self.col_width[i] = width
         self.max_width = self.term.COLS or 75
         self.width = sum(self.col_width) + len(self.seperator) * (
                 len(self.col_format) - 1) + (4 if self.borders else 0)
@@ -267,33 +910,392 @@ class Table(object):
     def render(self, stream=sys.stdout):
         cur_width = self.width if self.width < self.max_width \
                                else self.max_width
+        lines = []
         if self.borders:
-            stream.write("-"*cur_width + "\n")
+            lines.append("-"*cur_width + "\n")
 
         for row in self.rows:
-            if self.borders:
-                stream.write("| ")
-            for i, col in zip(range(0, len(row)), row):
-                if self.col_format[i] == "c":
-                    stream.write(col.center(self.col_width[i]))
-                elif self.col_format[i] == "l":
-                    stream.write(col.ljust(self.col_width[i]))
-                elif self.col_format[i] == "r":
-                    stream.write(col.rjust(self.col_width[i]))
-
-                if i < len(row) - 1:
-                    stream.write(self.seperator)
-
-            for i in range(len(row), len(self.col_format)):
-                stream.write(' ' * (self.col_width[i]))
-                if i < len(row) - 1:
-                    stream.write(self.seperator)
-
-            if self.borders:
-                stream.write(" |\n")
-                stream.write("-"*cur_width)
-
-            stream.write("\n")
+            lines.append(_format_row(self.term, row, self.col_format,
+                                     self.col_width, self.seperator,
+                                     self.borders, cur_width))
+            if len(lines) >= 1024:
+                stream.write(''.join(lines))
+                lines = []
 
         if self.borders and len(self.rows) == 0:
-            stream.write("-"*cur_width + "\n")
+            lines.append("-"*cur_width + "\n")
+        stream.write(''.join(lines))
+
+
+class StreamingTable(object):
+    """
+    Prints a Table while its rows are still produced
+
+    The column widths are either given or inferred from the first
+    `sample` rows, so the rows never have to be kept in memory. Output is
+    collected and written in large chunks.
+
+    Arguments:
+        term        - TerminalController instance
+        col_format  - format specs of cols (see Table)
+        seperator   - seperator between cols (default " ")
+        borders     - print borders around table and between rows
+                      (default False)
+        widths      - fixed column widths (default: inferred)
+        max_widths  - maximal column widths, longer cells are truncated
+        sample      - number of rows used to infer the widths
+                      (default 1000)
+        stream      - output stream (default sys.stdout)
+        buffer_size - number of characters collected before writing
+                      (default 65536, 0 writes every row immediately)
+
+    Example:
+        >>> with StreamingTable(term, 'lr') as table:
+        ...     for row in rows:
+        ...         table.write(row)
+    """
+
+    def __init__(self, term, col_format, seperator=" ", borders=False,
+                 widths=None, max_widths=None, sample=1000, stream=None,
+                 buffer_size=65536):
+        self.term = term
+        self.col_format = col_format
+        self.seperator = seperator
+        self.borders = borders
+        self.max_widths = max_widths
+        self.sample = sample
+        self.stream = stream or sys.stdout
+        self.buffer_size = buffer_size
+        self.col_width = list(widths) if widths else None
+        self.max_width = self.term.COLS or 75
+        #: widths cells get truncated to (None for unlimited columns)
+        self.limits = None
+        self.rows = 0
+        self._pending = []
+        self._buffer = []
+        self._buffered = 0
+        self._started = False
+
+    def _start(self):
+        if self.col_width is not None:
+            self.limits = list(self.col_width)
+        else:
+            self.limits = [None] * len(self.col_format)
+            self.col_width = [0] * len(self.col_format)
+            for row in self._pending:
+                for i, col in enumerate(row[:len(self.col_format)]):
+                    width = self.term.visible_width(col)
+                    if width > self.col_width[i]:
+                        self.col_width[i] = width
+        if self.max_widths:
+            for i, limit in enumerate(self.max_widths):
+                if limit:
+                    self.col_width[i] = min(self.col_width[i], limit)
+                    self.limits[i] = self.col_width[i]
+        self.width = sum(self.col_width) + len(self.seperator) * (
+                len(self.col_format) - 1) + (4 if self.borders else 0)
+        self.cur_width = min(self.width, self.max_width)
+        self._started = True
+        if self.borders:
+            self._emit("-"*self.cur_width + "\n")
+        pending, self._pending = self._pending, []
+        for row in pending:
+            self._write_row(row)
+
+    def _truncate(self, col, width):
+        text = self.term.remove_ctrl_chars(col)[:width]
+        while text and visible_width(text) > width - 1:
+            text = text[:-1]
+        return text + '\u2026' if width else ''
+
+    def _write_row(self, row):
+        limits = self.limits
+        if any(limit is not None for limit in limits):
+            row = [self._truncate(col, limits[i])
+                   if i < len(limits) and limits[i] is not None and
+                   self.term.visible_width(col) > limits[i]
+                   else col
+                   for i, col in enumerate(row)]
+        self.rows += 1
+        self._emit(_format_row(self.term, row, self.col_format,
+                               self.col_width, self.seperator, self.borders,
+                               self.cur_width))
+
+    def _emit(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def write(self, row):
+        """
+        Adds a row to the table
+        """
+        row = [_text(c) for c in row]
+        if self._started:
+            self._write_row(row)
+        elif self.col_width is not None:
+            self._start()
+            self._write_row(row)
+        else:
+            self._pending.append(row)
+            if len(self._pending) >= self.sample:
+                self._start()
+
+    def flush(self):
+        """
+        Writes all buffered output
+        """
+        if self._buffer:
+            self.stream.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        """
+        Writes the remaining rows and the end of the table
+        """
+        if not self._started:
+            self._start()
+        if self.borders and self.rows == 0:
+            self._emit("-"*self.cur_width + "\n")
+        self.flush()
+
+    def render(self, rows):
+        """
+        Writes all rows of the iterable and closes the table
+        """
+        for row in rows:
+            self.write(row)
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
+class TableView(object):
+    """
+    Interactive, paged view of a Table
+
+    Only the rows of the visible page are formatted and written, the
+    page is redrawn in place using the cursor capabilities of the
+    terminal. Sorting uses an index of row numbers per column, so
+    neither the rows are copied nor are unseen rows rendered.
+
+    Keys:
+        space, j, PgDn, Down - next page (j/Down: next row)
+        b, k, PgUp, Up       - previous page (k/Up: previous row)
+        g, Home / G, End     - first / last page
+        1-9                  - sort by column (again: reverse order)
+        q, Esc               - quit
+
+    Arguments:
+        term       - TerminalController instance
+        rows       - 2-dimensional array with table data
+        col_format - format specs of cols (see Table)
+        seperator  - seperator between cols (default " ")
+        header     - optional list of column titles
+        stream     - output stream (default sys.stdout)
+        input      - input stream of the key presses (default sys.stdin)
+    """
+    KEYS = {
+        ' ': 'next_page', '\x1b[6~': 'next_page',
+        'b': 'previous_page', '\x1b[5~': 'previous_page',
+        'j': 'next_row', '\x1b[B': 'next_row', '\x1bOB': 'next_row',
+        'k': 'previous_row', '\x1b[A': 'previous_row',
+        '\x1bOA': 'previous_row',
+        'g': 'first_page', '\x1b[H': 'first_page', '\x1b[1~': 'first_page',
+        'G': 'last_page', '\x1b[F': 'last_page', '\x1b[4~': 'last_page',
+    }
+    STATUS = '${REVERSE} rows {first}-{last} of {count}{order} ' \
+             '(space/b: page, 1-9: sort, q: quit) ${NORMAL}'
+
+    def __init__(self, term, rows, col_format, seperator=" ", header=None,
+                 stream=None, input=None):
+        self.term = term
+        self.rows = rows
+        self.col_format = col_format
+        self.seperator = seperator
+        self.header = [_text(c) for c in header] if header else None
+        self.stream = stream or sys.stdout
+        self.input = input or sys.stdin
+        self.offset = 0
+        self.order = None
+        self.sort_column = None
+        self.reverse = False
+        self._indexes = {}
+        self._drawn = 0
+
+    @property
+    def page_size(self):
+        lines = self.term.LINES or 24
+        return max(1, lines - 2 - (1 if self.header else 0))
+
+    def sort(self, column, reverse=False):
+        """
+        Sorts the view by the given column (None restores the original
+        order). The index is computed once per column and direction.
+        """
+        self.sort_column = column
+        self.reverse = reverse
+        if column is None:
+            self.order = None
+            return
+        key = (column, reverse)
+        if key not in self._indexes:
+            rows = self.rows
+
+            def value(i):
+                row = rows[i]
+                return row[column] if column < len(row) else None
+
+            indexes = range(len(rows))
+            try:
+                order = sorted(indexes, key=value, reverse=reverse)
+            except TypeError:
+                order = sorted(indexes, key=lambda i: _text(value(i)),
+                               reverse=reverse)
+            self._indexes[key] = order
+        self.order = self._indexes[key]
+
+    def _move(self, offset):
+        last = max(0, len(self.rows) - self.page_size)
+        self.offset = max(0, min(offset, last))
+
+    def next_page(self):
+        self._move(self.offset + self.page_size)
+
+    def previous_page(self):
+        self._move(self.offset - self.page_size)
+
+    def next_row(self):
+        self._move(self.offset + 1)
+
+    def previous_row(self):
+        self._move(self.offset - 1)
+
+    def first_page(self):
+        self._move(0)
+
+    def last_page(self):
+        self._move(len(self.rows))
+
+    def page(self):
+        """
+        Returns the rows of the visible page
+        """
+        end = min(self.offset + self.page_size, len(self.rows))
+        if self.order is None:
+            return [self.rows[i] for i in range(self.offset, end)]
+        return [self.rows[i] for i in self.order[self.offset:end]]
+
+    def render_page(self):
+        """
+        Returns the formatted visible page including the status line
+        """
+        page = [[_text(c) for c in row] for row in self.page()]
+        if self.header:
+            page.insert(0, self.header)
+        col_width = [0] * len(self.col_format)
+        for row in page:
+            for i, col in enumerate(row[:len(self.col_format)]):
+                width = self.term.visible_width(col)
+                if width > col_width[i]:
+                    col_width[i] = width
+        lines = [_format_row(self.term, row, self.col_format, col_width,
+                             self.seperator, False, 0)
+                 for row in page]
+        if self.header:
+            lines[0] = self.term.render('${BOLD}') + lines[0][:-1] + \
+                self.term.render('${NORMAL}') + '\n'
+        order = ''
+        if self.sort_column is not None:
+            order = ', sorted by column {}{}'.format(
+                self.sort_column + 1, ' (reversed)' if self.reverse else '')
+        status = self.term.render(self.STATUS).format(
+            first=min(self.offset + 1, len(self.rows)),
+            last=self.offset + len(page) - (1 if self.header else 0),
+            count=len(self.rows), order=order)
+        cols = self.term.COLS
+        if cols:
+            # wrapped lines would break redrawing the page in place
+            lines = [_clip(self.term, line[:-1], cols) + '\n'
+                     for line in lines]
+            status = _clip(self.term, status, cols)
+        lines.append(status)
+        return ''.join(lines)
+
+    def draw(self):
+        """
+        Redraws the visible page in place
+        """
+        output = self.render_page()
+        if self._drawn:
+            output = self.term.BOL + self.term.UP * self._drawn + \
+                self.term.CLEAR_EOS + output
+        self._drawn = output.count('\n')
+        self.stream.write(output)
+        self.stream.flush()
+
+    def handle_key(self, key):
+        """
+        Handles a key press, returns False if the view should be closed
+        """
+        if key in ('q', 'Q', '\x1b', '\x03', '\x04', ''):
+            return False
+        if key.isdigit() and key != '0':
+            column = int(key) - 1
+            if column < len(self.col_format):
+                reverse = column == self.sort_column and not self.reverse
+                self.sort(column, reverse)
+                self.offset = 0
+        elif key in self.KEYS:
+            getattr(self, self.KEYS[key])()
+        return True
+
+    def _read_key(self):
+        import select
+        fd = self.input.fileno()
+        key = os.read(fd, 1).decode('latin-1')
+        if key == '\x1b':
+            # escape sequences arrive at once, a lone escape doesn't
+            while select.select([fd], [], [], 0.05)[0]:
+                key += os.read(fd, 1).decode('latin-1')
+                if key[-1].isalpha() or key[-1] == '~':
+                    break
+        return key
+
+    def run(self):
+        """
+        Shows the view until it is closed. Renders the whole table if the
+        terminal isn't interactive or capable enough.
+        """
+        if not (self.input.isatty() and self.term.UP and
+                self.term.CLEAR_EOS):
+            rows = self.rows
+            if self.order is not None:
+                rows = (self.rows[i] for i in self.order)
+            table = StreamingTable(self.term, self.col_format,
+                                   self.seperator, stream=self.stream)
+            if self.header:
+                table.write(self.header)
+            table.render(rows)
+            return
+
+        import termios
+        import tty
+        fd = self.input.fileno()
+        settings = termios.tcgetattr(fd)
+        self.stream.write(self.term.HIDE_CURSOR)
+        try:
+            tty.setcbreak(fd)
+            self.draw()
+            while self.handle_key(self._read_key()):
+                self.draw()
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, settings)
+            self.stream.write(self.term.SHOW_CURSOR + '\n')
+            self.stream.flush()
@@ -0,0 +1,63 @@
+import asyncio
+import io
+import time
+from unittest import TestCase
+from helperlib.aiospinner import waitfor
+
+
+class _TTY(io.StringIO):
+    def isatty(self):
+        return True
+
+
+class AsyncSpinnerTestCase(TestCase):
+    def test_animation(self):
+        out = _TTY()
+
+        async def run():
+            async with waitfor('work', stream=out, interval=0.01) as spinner:
+                spinner.status('step')
+                await asyncio.sleep(0.05)
+            return spinner
+
+        spinner = asyncio.run(run())
+        output = out.getvalue()
+        self.assertIn('work: step\x1b[G', output)
+        marker = spinner.term.bind('[${BOLD}${GREEN}+${NORMAL}]')
+        self.assertTrue(output.endswith(
+            '\x1b[K' + marker + ' work: Done\n\x1b[?25h'))
+        self.assertIsNone(spinner._handle)
+
+    def test_text_not_rendered(self):
+        for out in (_TTY(), io.StringIO()):
+            async def run():
+                async with waitfor('cost ${price}', stream=out,
+                                   interval=0.01) as spinner:
+                    spinner.status('${UNKNOWN} $$')
+                    await asyncio.sleep(0.03)
+                    spinner.succeeded('${done}')
+
+            asyncio.run(run())
+            self.assertIn('cost ${price}: ${done}\n', out.getvalue())
+
+    def test_stop_latency(self):
+        out = _TTY()
+
+        async def run():
+            async with waitfor('short', stream=out, interval=10):
+                pass
+
+        start = time.time()
+        asyncio.run(run())
+        self.assertLess(time.time() - start, 0.05)
+
+    def test_failed(self):
+        out = io.StringIO()
+
+        async def run():
+            async with waitfor('job', stream=out):
+                raise ValueError()
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
+        self.assertEqual(out.getvalue(), 'job\n[-] job: FAILED!\n')
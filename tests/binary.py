@@ -1,5 +1,9 @@
-from unittest import TestCase
+import io
+from unittest import TestCase, mock
+from helperlib import binary
 from helperlib.binary import *
+from helperlib.terminal import TerminalController
+
 
 class HexdumpTestCase(TestCase):
     def test_hexdump(self):
@@ -287,3 +291,306 @@ class HexdumpTestCase(TestCase):
 
         parsed = parse_hexII(source)
         self.assertEqual(parsed, expected)
+
+
+class TLV(Structure):
+    _fields_ = [
+        ('<H', 'type'),
+        ('H', 'length'),
+        ('s', 'value', 'length'),
+        ('I', 'crc'),
+    ]
+
+
+class Record(Structure):
+    _fields_ = [
+        ('<B', 'tag'),
+        (TLV, 'tlv'),
+        ('<I', 'trailer'),
+    ]
+
+
+class StructureTestCase(TestCase):
+    def test_variable_field(self):
+        a = TLV(b'\x01\x00\x03\x00abc\x04\x03\x02\x01')
+        b = TLV(b'\x02\x00\x01\x00z\x01\x00\x00\x00')
+        self.assertEqual(a.value, b'abc')
+        self.assertEqual(b.value, b'z')
+        self.assertEqual(a.crc, 0x01020304)
+        self.assertEqual(b.crc, 1)
+        self.assertEqual(a.dynamic_size, 11)
+        self.assertEqual(TLV.struct_size, 8)
+        # the shared descriptor must not be modified by an access
+        self.assertEqual(TLV.value.format, '<0s')
+
+    def test_set_variable_field(self):
+        t = TLV(10)
+        t.length = 2
+        t.value = b'hi'
+        t.crc = 5
+        self.assertEqual(t.raw_bytes, b'\x00\x00\x02\x00hi\x05\x00\x00\x00')
+        with self.assertRaises(ValueError):
+            t.value = b'foo'
+
+    def test_nested_variable_struct(self):
+        r = Record(b'\x09\x01\x00\x03\x00abc\x04\x03\x02\x01\xff\x00\x00\x00')
+        self.assertEqual(r.tlv.value, b'abc')
+        self.assertEqual(r.tlv.crc, 0x01020304)
+        self.assertEqual(r.trailer, 0xff)
+        self.assertEqual(r.dynamic_size, 16)
+
+    def test_nested_length_change(self):
+        r = Record(bytearray(b'\x09\x01\x00\x03\x00abc\x04\x03\x02\x01'
+                             b'\xff\x00\x00\x00\x00'))
+        tlv = r.tlv
+        self.assertEqual(r.dynamic_size, 16)
+        tlv.length = 4
+        self.assertIs(tlv._parent, r)
+        self.assertEqual(r.dynamic_size, 17)
+        self.assertEqual(r.trailer, 0)
+        self.assertEqual(r.tlv.crc, 0xff010203)
+        self.assertEqual(r.tlv.value, b'abc\x04')
+        self.assertIsNot(r.tlv, tlv)
+
+    def test_length_field_order(self):
+        with self.assertRaises(TypeError):
+            class Invalid(Structure):
+                _fields_ = [('<s', 'value', 'length'), ('H', 'length')]
+
+    def test_pack_many(self):
+        class Point(Structure):
+            _fields_ = [('<H', 'x'), ('H', 'y')]
+
+        data = Point.pack_many([(1, 2), {'x': 3, 'y': 4}])
+        self.assertEqual(bytes(data), b'\x01\x00\x02\x00\x03\x00\x04\x00')
+        buf = bytearray(8)
+        Point.pack_many([(5, 6)], buf, 2)
+        self.assertEqual(bytes(buf), b'\x00\x00\x05\x00\x06\x00\x00\x00')
+        with self.assertRaises(TypeError):
+            TLV.pack_many([(1, 3, b'abc', 0)])
+
+    def test_pack_many_single_element_array(self):
+        class Sample(Structure):
+            _codegen_ = True
+            _fields_ = [('<I', 'a', 1), ('H', 'b')]
+
+        data = Sample.pack_many([([1], 2), {'a': [3], 'b': 4}])
+        self.assertEqual(data, b'\x01\x00\x00\x00\x02\x00'
+                               b'\x03\x00\x00\x00\x04\x00')
+        s = Sample(bytearray(data[:6]))
+        self.assertEqual(repr(s), 'Sample(a=[1], b=2)')
+        self.assertEqual(s.to_dict(), {'a': [1], 'b': 2})
+
+    def test_pack_many_nested(self):
+        class Point(Structure):
+            _fields_ = [('<H', 'x'), ('H', 'y')]
+
+        class Line(Structure):
+            _fields_ = [('<B', 'color'), (Point, 'start'), ('>2H', 'end')]
+
+        data = Line.pack_many([(1, (2, 3), (4, 5))])
+        self.assertEqual(bytes(data),
+                         b'\x01\x02\x00\x03\x00\x00\x04\x00\x05')
+        line = Line(data)
+        self.assertEqual(line.start.y, 3)
+        self.assertEqual(line.end, (4, 5))
+
+    def test_write_many(self):
+        class Pair(Structure):
+            _fields_ = [('<B', 'a'), ('>H', 'b')]
+
+        out = io.BytesIO()
+        count = Pair.write_many(out, ((i, i) for i in range(5)), 2)
+        self.assertEqual(count, 5)
+        self.assertEqual(out.getvalue(), b''.join(
+            bytes([i, 0, i]) for i in range(5)))
+
+    def test_codegen(self):
+        class Header(Structure):
+            _codegen_ = True
+            _fields_ = [('<I', 'magic'), ('H', 'version'), ('2B', 'flags')]
+
+        class Packet(Structure):
+            _codegen_ = True
+            _fields_ = [('<H', 'length'), ('s', 'data', 'length'),
+                        ('I', 'crc'), (Header, 'header')]
+
+        h = Header(bytearray(b'\x01\x00\x00\x00\x02\x00\x03\x04'))
+        self.assertIsInstance(Header.magic, property)
+        self.assertEqual(repr(h), 'Header(magic=1, version=2, flags=(3, 4))')
+        self.assertEqual(h.to_dict(), {'magic': 1, 'version': 2, 'flags': (3, 4)})
+        self.assertEqual(h, Header(h.raw_bytes))
+        h.version = 5
+        h.flags = (6, 7)
+        self.assertEqual(h.raw_bytes, b'\x01\x00\x00\x00\x05\x00\x06\x07')
+        self.assertNotEqual(h, Header(8))
+
+        p = Packet(bytearray(2 + 3 + 4 + 8))
+        p.length = 3
+        p.data = b'abc'
+        p.crc = 0x11223344
+        self.assertEqual(p.raw_bytes[5:9], b'\x44\x33\x22\x11')
+        self.assertEqual(p.to_dict()['header'], Header().to_dict())
+
+    def test_codegen_nested_eq(self):
+        class Point(Structure):
+            _fields_ = [('<H', 'x'), ('H', 'y')]
+
+        class Line(Structure):
+            _codegen_ = True
+            _fields_ = [('<B', 'color'), (Point, 'start'), (Point, 'end')]
+
+        data = b'\x01\x01\x00\x02\x00\x03\x00\x04\x00'
+        self.assertEqual(Line(bytearray(data)), Line(bytearray(data)))
+        other = Line(bytearray(data))
+        other.end.y = 5
+        self.assertNotEqual(Line(bytearray(data)), other)
+
+    def test_codegen_invalid_name(self):
+        with self.assertRaises(TypeError):
+            class Invalid(Structure):
+                _codegen_ = True
+                _fields_ = [('<I', 'class')]
+
+    def test_bitfields(self):
+        class Flags(Structure):
+            _fields_ = [
+                ('<B', 'kind'),
+                ('H', 'flags', [('ack', 0, 1), ('syn', 1, 1), ('window', 4, 4)]),
+                ('b', 'nibbles', [('low', 0, 4), ('high', 4, 4)]),
+            ]
+
+        f = Flags(bytearray(b'\x01\x13\x00\x00'))
+        self.assertEqual((f.ack, f.syn, f.window), (1, 1, 1))
+        self.assertEqual(f.decode_bitfields('flags'),
+                         {'ack': 1, 'syn': 1, 'window': 1})
+        f.window = 15
+        f.ack = 0
+        self.assertEqual(f.flags, 0xf2)
+        f.high = 15
+        self.assertEqual(f.nibbles, -16)
+        with self.assertRaises(ValueError):
+            f.window = 16
+        with self.assertRaises(TypeError):
+            class Invalid(Structure):
+                _fields_ = [('<B', 'flags', [('wide', 4, 5)])]
+
+    def test_array_fields(self):
+        class Point(Structure):
+            _fields_ = [('<H', 'x'), ('H', 'y')]
+
+        class Table(Structure):
+            _fields_ = [
+                ('<B', 'count'),
+                ('I', 'values', 4),
+                ('>H', 'big', 2),
+                (Point, 'points', 2),
+            ]
+
+        t = Table(bytearray(Table.struct_size))
+        self.assertEqual(Table.struct_size, 1 + 16 + 4 + 8)
+        self.assertIsInstance(t.values, memoryview)
+        t.values[2] = 7
+        t.big[1] = 0x102
+        t.points[1].y = 5
+        t.points[0] = (1, 2)
+        self.assertEqual(t.raw_bytes[9:13], b'\x07\x00\x00\x00')
+        self.assertEqual(t.raw_bytes[19:21], b'\x01\x02')
+        self.assertEqual(t.big.tolist(), [0, 0x102])
+        self.assertEqual(t.to_dict()['points'],
+                         [{'x': 1, 'y': 2}, {'x': 0, 'y': 5}])
+        t.values = [1, 2, 3, 4]
+        self.assertEqual(list(t.values), [1, 2, 3, 4])
+        self.assertEqual(bytes(Table.pack_many([t.to_dict()])), t.raw_bytes)
+        with self.assertRaises(IndexError):
+            t.points[2]
+
+    def test_format_struct(self):
+        class Point(Structure):
+            _fields_ = [('<H', 'x'), ('H', 'y')]
+
+        class Shape(Structure):
+            _fields_ = [('<B', 'kind'), (Point, 'points', 3)]
+
+        s = Shape(bytearray(Shape.struct_size))
+        s.kind = 1
+        s.points[0].x = 5
+        self.assertEqual(format_struct(s, max_items=1), '\n'.join([
+            'kind: 1',
+            'points: [',
+            '  ',
+            '  x: 5',
+            '  y: 0',
+            '  ...',
+            ' ]',
+            '',
+        ]))
+        self.assertEqual(format_struct(s, max_depth=1), 'kind: 1\npoints: ...\n')
+        out = io.StringIO()
+        print_struct(s, file=out, max_depth=1, chunk_size=4)
+        self.assertEqual(out.getvalue(), 'kind: 1\npoints: ...\n')
+
+    def test_offset_table(self):
+        class Point(Structure):
+            _fields_ = [('<H', 'x'), ('H', 'y')]
+
+        class Header(Structure):
+            _fields_ = [('<I', 'magic'), (Point, 'pos'), (Point, 'points', 2),
+                        ('I', 'table', 4), ('H', 'length'),
+                        ('s', 'name', 'length'), ('I', 'crc')]
+
+        self.assertEqual([field.path for field in Header.offset_table], [
+            'magic', 'pos.x', 'pos.y', 'points[0].x', 'points[0].y',
+            'points[1].x', 'points[1].y', 'table', 'length'])
+        self.assertEqual(Header.field_at(3).path, 'magic')
+        self.assertEqual(Header.field_at(14).path, 'points[1].y')
+        self.assertEqual(Header.field_at(29)[:3], (28, 4, 'table[3]'))
+        self.assertIsNone(Header.field_at(100))
+        self.assertEqual([field.path for field in Header.fields_in_range(5, 9)],
+                         ['pos.x', 'pos.y', 'points[0].x'])
+
+    def test_annotated_hexdump(self):
+        class Point(Structure):
+            _fields_ = [('<H', 'x'), ('H', 'y')]
+
+        out = io.StringIO()
+        print_hexdump(bytes(range(10)), cols=8, file=out, struct_type=Point)
+        self.assertEqual(out.getvalue().splitlines(), [
+            '0: 00 01 02 03 04 05 06 07 ........ x, y, x, y',
+            '8: 08 09                   ..       x',
+        ])
+
+        # positional arguments are still passed on to hexdump (folded)
+        out = io.StringIO()
+        print_hexdump(bytes(32), False, 8, out, False, False, True)
+        self.assertEqual(out.getvalue().splitlines(), [
+            '00: 00 00 00 00 00 00 00 00 ........',
+            '    *',
+        ])
+
+    def test_colored_struct_hexdump(self):
+        class Point(Structure):
+            _fields_ = [('<H', 'x'), ('H', 'y')]
+
+        # without a terminal all colour sequences are empty
+        out = io.StringIO()
+        print_hexdump(bytes(range(10)), cols=8, file=out, struct_type=Point,
+                      colored=True)
+        self.assertEqual(out.getvalue().splitlines(), [
+            'x y',
+            '0: 00 01 02 03 04 05 06 07 ........ x, y, x, y',
+            '8: 08 09                   ..       x',
+        ])
+
+        # only the columns holding bytes are coloured
+        term = TerminalController(io.StringIO())
+        term.NORMAL, term.CYAN, term.GREEN, term.YELLOW = '<N>', '<C>', '<G>', '<Y>'
+        out = io.StringIO()
+        with mock.patch.object(binary, 'TERM', term):
+            print_hexdump(bytes(range(8)), cols=8, file=out, struct_type=Point,
+                          colored=True, offset=2)
+        self.assertEqual(out.getvalue().splitlines(), [
+            '<G>x <Y>y<N>',
+            '<C>0:       <G>00 01 <Y>02 03 <G>04 05   <G>..<Y>..<G>..<N> x, y, x',
+            '<C>8: <Y>06 07                   <Y>..<N>       y',
+        ])
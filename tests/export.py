@@ -0,0 +1,62 @@
+import io
+import json
+from unittest import TestCase, skipUnless
+from helperlib.binary import Structure
+from helperlib.export import *
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+
+class Point(Structure):
+    _fields_ = [('<H', 'x'), ('H', 'y')]
+
+
+class Sample(Structure):
+    _fields_ = [('<I', 'id'), ('2s', 'tag'), (Point, 'pos'), ('>H', 'values', 2)]
+
+
+class ExportTestCase(TestCase):
+    def test_column_names(self):
+        self.assertListEqual(column_names(Sample),
+                             ['id', 'tag', 'pos.x', 'pos.y', 'values[0]', 'values[1]'])
+
+    def test_iter_columns(self):
+        data = Point.pack_many([(i, i * 2) for i in range(5)])
+        chunks = list(iter_columns(Point, io.BytesIO(bytes(data)), 2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[0], [(0, 1), (0, 2)])
+        with self.assertRaises(IOError):
+            list(iter_columns(Point, bytes(data)[:-1]))
+
+    def test_export_csv(self):
+        data = Sample.pack_many([(i, b'ab', (i, 1), (2, 3)) for i in range(3)])
+        for pipeline in (True, False):
+            out = io.StringIO()
+            count = export_records(Sample, data, out, chunk_size=2,
+                                   pipeline=pipeline)
+            self.assertEqual(count, 3)
+            self.assertEqual(out.getvalue().splitlines(), [
+                'id,tag,pos.x,pos.y,values[0],values[1]',
+                '0,6162,0,1,2,3',
+                '1,6162,1,1,2,3',
+                '2,6162,2,1,2,3',
+            ])
+
+    def test_export_ndjson(self):
+        data = Point.pack_many([(1, 2), (3, 4)])
+        out = io.StringIO()
+        export_records(Point, data, out, 'ndjson')
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()],
+                         [{'x': 1, 'y': 2}, {'x': 3, 'y': 4}])
+
+    @skipUnless(pyarrow, 'requires pyarrow')
+    def test_export_arrow_empty(self):
+        out = io.BytesIO()
+        self.assertEqual(export_records(Sample, b'', out, 'arrow'), 0)
+        table = pyarrow.ipc.open_file(pyarrow.py_buffer(out.getvalue())).read_all()
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.schema.names, column_names(Sample))
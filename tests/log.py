@@ -0,0 +1,274 @@
+import atexit
+import io
+import queue
+import sys
+import threading
+import logging
+import os
+from unittest import TestCase, mock
+from helperlib import terminal
+from helperlib.logging import *
+
+
+def _record(level, msg, *args):
+    return logging.LogRecord('test', level, __file__, 1, msg, args, None)
+
+
+class ColorFormatterTestCase(TestCase):
+    def setUp(self):
+        terminal._capabilities.clear()
+        self.master, slave = os.openpty()
+        self.tty = os.fdopen(slave, 'w')
+        self.env = mock.patch.dict(os.environ, {'TERM': 'xterm'})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tty.close()
+        os.close(self.master)
+        terminal._capabilities.clear()
+
+    def test_colors(self):
+        formatter = ColorFormatter('${BOLD}x${NORMAL} [%(levelname)s] %(message)s',
+                                   stream=self.tty)
+        term = formatter.term
+        self.assertEqual(
+            formatter.format(_record(logging.ERROR, 'a ${RED} %s', 1)),
+            term.BOLD + 'x' + term.NORMAL + ' [' + term.RED + 'ERROR' +
+            term.NORMAL + '] a ${RED} 1')
+        self.assertEqual(formatter.format(_record(25, 'custom')),
+                         term.BOLD + 'x' + term.NORMAL + ' [Level 25' +
+                         term.NORMAL + '] custom')
+
+    def test_new_style(self):
+        formatter = NewColorFormatter('[{levelname:>5}] {message}',
+                                      stream=self.tty)
+        term = formatter.term
+        self.assertEqual(formatter.format(_record(logging.INFO, 'msg')),
+                         '[' + term.GREEN + ' INFO' + term.NORMAL + '] msg')
+
+    def test_plain(self):
+        record = _record(logging.WARNING, 'msg %d', 2)
+        for formatter in (ColorFormatter('[%(levelname)s] %(message)s',
+                                         stream=io.StringIO()),
+                          ColorFormatter('[%(levelname)s] %(message)s',
+                                         stream=self.tty, color=False)):
+            self.assertIsNone(formatter.colors)
+            self.assertEqual(formatter.format(record), '[WARNING] msg 2')
+        self.assertFalse(hasattr(record, 'levelcolor'))
+
+
+class _CountingStream(io.StringIO):
+    writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super(_CountingStream, self).write(text)
+
+
+class QueueLoggingTestCase(TestCase):
+    def setUp(self):
+        self.stream = _CountingStream()
+        self.logger = logging.getLogger('helperlib.tests.queue')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = logging.StreamHandler(self.stream)
+        self.handler.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+    def test_batches(self):
+        listener = queue_logging(self.logger)
+        self.addCleanup(atexit.unregister, listener.stop)
+        self.assertIsInstance(self.logger.handlers[0], BoundedQueueHandler)
+        for i in range(2000):
+            self.logger.info('line %d', i)
+            self.logger.debug('filtered')
+        listener.stop()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 2000)
+        self.assertEqual(lines[-1], 'line 1999')
+        self.assertLess(self.stream.writes, 2000)
+
+    def test_overflow(self):
+        for policy, expected in (('drop', ['0', '1']), ('drop_oldest', ['3', '4'])):
+            records = queue.Queue(2)
+            handler = BoundedQueueHandler(records, policy)
+            for i in range(5):
+                handler.handle(logging.makeLogRecord({'msg': str(i)}))
+            self.assertEqual(handler.dropped, 3)
+            self.assertEqual([records.get().msg for _ in range(2)], expected)
+        with self.assertRaises(ValueError):
+            BoundedQueueHandler(records, 'ignore')
+
+    def test_report_drops(self):
+        records = queue.Queue(1)
+        handler = BoundedQueueHandler(records, 'drop')
+        listener = BatchQueueListener(records, *self.logger.handlers,
+                                      queue_handler=handler)
+        for i in range(3):
+            handler.handle(logging.makeLogRecord({'msg': str(i),
+                                                  'levelno': logging.INFO}))
+        listener.start()
+        listener.stop()
+        self.assertEqual(self.stream.getvalue(),
+                         '0\n2 log records dropped\n')
+
+    def test_format_error(self):
+        handler = self.handler
+        handler.setFormatter(logging.Formatter('%(user)s: %(message)s'))
+        listener = BatchQueueListener(queue.Queue(), handler)
+        records = [logging.makeLogRecord({'msg': msg, 'levelno': logging.INFO,
+                                          'user': 'u'})
+                   for msg in ('first', 'bad', 'last')]
+        del records[1].user
+        with mock.patch.object(handler, 'handleError') as handle_error:
+            listener.handle(records)
+        handle_error.assert_called_once_with(records[1])
+        self.assertEqual(self.stream.getvalue(), 'u: first\nu: last\n')
+        self.assertEqual(self.stream.writes, 1)
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super(_ListHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelno, record.getMessage()))
+
+
+class LogPipeTestCase(TestCase):
+    def setUp(self):
+        self.handler = _ListHandler()
+        self.logger = logging.getLogger('helperlib.tests.pipe')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def messages(self):
+        return [message for _, message in self.handler.messages]
+
+    def test_lines(self):
+        with LogPipe('WARNING', logger=self.logger.name, chunk_size=4,
+                     tail=2) as pipe:
+            os.write(pipe.fileno(), b'first 100%\r\nsec')
+            os.write(pipe.fileno(), b'ond\n\xff\nlast')
+        self.assertEqual(self.handler.messages[0], (logging.WARNING, 'first 100%'))
+        self.assertEqual(self.messages()[1:], ['second', '�', 'last'])
+        self.assertEqual(list(pipe.tail), ['�', 'last'])
+        self.assertEqual((pipe.lines, pipe.bytes), (4, 25))
+
+    def test_strict(self):
+        with LogPipe(logging.INFO, logger=self.logger.name,
+                     errors='strict') as pipe:
+            os.write(pipe.fileno(), b'\xff\n')
+        self.assertEqual(self.messages(), ['\\xff'])
+
+    def test_sample(self):
+        with LogPipe(logging.INFO, logger=self.logger.name, chunk_size=7,
+                     sample=3) as pipe:
+            os.write(pipe.fileno(), b''.join(b'%d\n' % i for i in range(10)))
+        self.assertEqual(self.messages(), ['0', '3', '6', '9'])
+
+    def test_rate_limit(self):
+        with LogPipe(logging.INFO, logger=self.logger.name,
+                     rate_limit=5) as pipe:
+            os.write(pipe.fileno(), b'x\n' * 100)
+        self.assertEqual(self.messages(), ['x'] * 5 + ['95 lines suppressed'])
+        self.assertEqual(pipe.suppressed, 95)
+
+
+class LogPumpTestCase(TestCase):
+    def setUp(self):
+        self.handler = _ListHandler()
+        self.logger = logging.getLogger('helperlib.tests.pump')
+        self.logger.propagate = True
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_subprocesses(self):
+        import subprocess
+        import sys
+        pump = LogPump()
+        pipes = []
+        children = []
+        for i in range(20):
+            name = '{}.{}'.format(self.logger.name, i)
+            out = pump.pipe(logging.INFO, logger=name)
+            err = pump.pipe(logging.ERROR, logger=name)
+            children.append(subprocess.Popen(
+                [sys.executable, '-c',
+                 'import sys; print("out\\n" * 100); sys.stderr.write("err")'],
+                stdout=out, stderr=err))
+            pipes.append((out, err))
+        threads = {t.name for t in threading.enumerate()}
+        self.assertNotIn('LogPipe', threads)
+        for child in children:
+            child.wait()
+        pump.close()
+        self.assertIsNone(pump._thread)
+        for out, err in pipes:
+            self.assertEqual((out.lines, out.bytes), (101, 401))
+            self.assertEqual((err.lines, err.bytes), (1, 3))
+        self.assertEqual(len(self.handler.messages), 20 * 102)
+        self.assertEqual(self.handler.messages.count((logging.ERROR, 'err')), 20)
+
+    def test_restart(self):
+        pump = LogPump()
+        for i in range(2):
+            with pump.pipe(logging.INFO, logger=self.logger.name) as pipe:
+                os.write(pipe.fileno(), b'line %d' % i)
+        self.assertEqual(self.handler.messages,
+                         [(logging.INFO, 'line 0'), (logging.INFO, 'line 1')])
+
+
+class JSONFormatterTestCase(TestCase):
+    def setUp(self):
+        self.record = _record(logging.INFO, 'took %.1fs', 1.25)
+        self.record.user = 'ålice'
+        self.record.data = {'id': 1}
+
+    def test_format(self):
+        import json
+        from helperlib import logging as hl_logging
+        with mock.patch.object(hl_logging, 'orjson', None):
+            line = JSONFormatter().format(self.record)
+        self.assertTrue(line.startswith('{"time":'))
+        self.assertEqual(json.loads(line), {
+            'time': self.record.created, 'level': 'INFO', 'logger': 'test',
+            'message': 'took 1.2s', 'user': 'ålice', 'data': {'id': 1}})
+
+    def test_fields_and_exception(self):
+        import json
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = logging.LogRecord('test', logging.ERROR, __file__, 1,
+                                       'failed', None, sys.exc_info())
+        record.obj = object()
+        formatter = JSONFormatter(fields=[('levelno', 'lvl')], extra=False)
+        data = json.loads(formatter.format(record))
+        self.assertEqual(data['lvl'], logging.ERROR)
+        self.assertNotIn('obj', data)
+        self.assertIn('ValueError: boom', data['exc_info'])
+        data = json.loads(JSONFormatter().format(record))
+        self.assertTrue(data['obj'].startswith('<object object'))
+
+    def test_default_config(self):
+        options = default_config(auto_init=False, json_file='log.json')
+        self.assertEqual(options['root']['handlers'], ['console', 'json'])
+        self.assertEqual(options['handlers']['json']['filename'], 'log.json')
+        self.assertEqual(options['formatters']['json']['()'],
+                         'helperlib.logging.JSONFormatter')
+        self.assertEqual(default_config(auto_init=False)['root']['handlers'],
+                         ['console'])
@@ -0,0 +1,182 @@
+import io
+import json
+import re
+import threading
+from collections import deque
+from unittest import TestCase, mock
+from helperlib import spinner
+
+
+class ProgressInfoTestCase(TestCase):
+    def test_format_amount(self):
+        self.assertEqual(spinner._format_amount(12, ''), '12')
+        self.assertEqual(spinner._format_amount(1023, 'B'), '1023B')
+        self.assertEqual(spinner._format_amount(1536, 'B'), '1.5KiB')
+        self.assertEqual(spinner._format_amount(3 * 1024 ** 3, 'B'), '3.0GiB')
+
+    def test_rate_and_eta(self):
+        samples = deque()
+        self.assertEqual(spinner._progress_info((0, 100, ''), samples, 0.0),
+                         '0/100 (0%), 0/s')
+        self.assertEqual(spinner._progress_info((10, 100, ''), samples, 1.0),
+                         '10/100 (10%), 10/s, ETA 0:00:09')
+        self.assertEqual(spinner._progress_info((30, None, ''), samples, 2.0),
+                         '30, 15/s')
+
+    def test_window(self):
+        samples = deque()
+        for now in range(10):
+            spinner._progress_info((now * 10, None, ''), samples, float(now))
+        self.assertEqual(samples[0][0], 4.0)
+
+    def test_log_timing(self):
+        with mock.patch.object(spinner.time, 'time', return_value=3.5), \
+                mock.patch.object(spinner._log, 'info') as info:
+            spinner._log_timing('job', [('', 0.0), ('load', 1.0)], 'Done')
+        info.assert_called_once_with('%s: %s after %.3fs (%s)', 'job', 'Done',
+                                     3.5, '- 1.000s, load 2.500s')
+
+
+class SpinnerManagerTestCase(TestCase):
+    def setUp(self):
+        self.out = io.StringIO()
+        self.manager = spinner.SpinnerManager(self.out, interval=60)
+
+    def frames(self):
+        return self.out.getvalue().split('\x1b[J')
+
+    def test_concurrent(self):
+        first = self.manager.waitfor('a')
+        second = self.manager.waitfor('b')
+        first.status('working')
+        second.progress(5, 10)
+        self.assertEqual(len(self.frames()), 3)
+        self.manager.render()
+        frame = self.frames()[-2]
+        self.assertEqual(frame.count('\n'), 2)
+        self.assertIn('a: working\n', frame)
+        self.assertIn('b: 5/10 (50%), 0/s\n', frame)
+        self.assertTrue(frame.startswith('\x1b[?25l\x1b[2F'))
+
+    def test_nested_and_finish(self):
+        outer = self.manager.waitfor('outer')
+        other = self.manager.waitfor('other')
+        with outer.waitfor('inner') as inner:
+            self.assertEqual(self.manager.tasks, [outer, inner, other])
+            self.assertEqual(inner.depth, 1)
+        self.assertEqual(self.manager.tasks, [outer, other])
+        self.assertIn('\x1b[K  [+] inner: Done\n', self.frames()[-2])
+        outer.failed()
+        other.succeeded()
+        self.assertIsNone(self.manager._thread)
+        self.assertTrue(self.out.getvalue().endswith(
+            '\x1b[1F\x1b[K[+] other: Done\n\x1b[J\x1b[?25h'))
+
+    def test_write(self):
+        task = self.manager.waitfor('task')
+        self.manager.write('hello')
+        self.assertIn('\x1b[1F\x1b[Khello\n \x1b[K', self.out.getvalue())
+        task.succeeded()
+        self.manager.write('bye')
+        self.assertTrue(self.out.getvalue().endswith('bye'))
+
+    def test_status_not_rendered(self):
+        task = self.manager.waitfor('${task}')
+        task.status('costs ${UNKNOWN} $$')
+        self.manager._frame()
+        self.assertIn('${task}: costs ${UNKNOWN} $$\n', self.frames()[-2])
+        task.failed('${NOPE}')
+        self.assertIn('${task}: ${NOPE}\n', self.out.getvalue())
+
+    def test_terminal_width(self):
+        task = self.manager.waitfor('task')
+        nested = task.waitfor('nested')
+        task.spinner = nested.spinner = ['/.......']
+        task.status('x' * 100)
+        nested.status('y' * 100 + '\nsecond ' + 'z' * 100)
+        with mock.patch.object(spinner, '_terminal_width', return_value=40):
+            self.manager.render()
+        lines = re.sub(r'\x1b\[[0-9;?]*[A-Za-z]', '',
+                       self.frames()[-2]).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(len(lines[0]), 40)
+        for line in lines:
+            self.assertLessEqual(len(line), 40)
+        nested.succeeded()
+        task.succeeded()
+
+    def test_multiline_status(self):
+        task = self.manager.waitfor('task')
+        lines = task.format('[*]', 'first\nsecond', width=12)
+        self.assertEqual(lines, ['[*] task: fi', '      se'])
+        task.succeeded()
+
+
+class ModuleFunctionsTestCase(TestCase):
+    def setUp(self):
+        self.out = io.StringIO()
+        patcher = mock.patch.object(
+            spinner, '_manager', spinner.SpinnerManager(self.out, interval=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_worker_thread(self):
+        task = spinner.waitfor('main')
+
+        def work():
+            spinner.status('from worker')
+            spinner.progress(3, 4)
+
+        worker = threading.Thread(target=work)
+        worker.start()
+        worker.join()
+        self.assertEqual(task._status, 'from worker')
+        self.assertEqual(task._progress, (3, 4, ''))
+        spinner.succeeded()
+        self.assertTrue(task.finished)
+        worker = threading.Thread(target=work)
+        with mock.patch.object(threading, 'excepthook') as hook:
+            worker.start()
+            worker.join()
+        self.assertIn('waitfor has not been called',
+                      str(hook.call_args[0][0].exc_value))
+
+
+class PlainSpinnerManagerTestCase(TestCase):
+    def setUp(self):
+        self.out = io.StringIO()
+
+    def test_summaries(self):
+        manager = spinner.PlainSpinnerManager(self.out, interval=60)
+        task = manager.waitfor('job')
+        for i in range(1000):
+            task.status('item %d' % i)
+        manager._frame()
+        manager._frame()
+        with task.waitfor('sub'):
+            pass
+        task.failed()
+        lines = self.out.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[0], '[*] job')
+        self.assertTrue(lines[1].startswith('[*] job: item 999 ('))
+        self.assertEqual(lines[2], '[*] job > sub')
+        self.assertTrue(lines[3].startswith('[+] job > sub: Done ('))
+        self.assertTrue(lines[4].startswith('[-] job: FAILED! ('))
+        self.assertIsNone(manager._thread)
+
+    def test_json(self):
+        manager = spinner.PlainSpinnerManager(self.out, interval=60, json=True)
+        task = manager.waitfor('copy')
+        task.progress(10, 20, 'B')
+        manager._frame()
+        manager.write('hello ${X}\n')
+        task.succeeded()
+        records = [json.loads(line) for line in self.out.getvalue().splitlines()]
+        self.assertEqual([r['event'] for r in records],
+                         ['start', 'status', 'message', 'succeeded'])
+        self.assertEqual(records[1]['done'], 10)
+        self.assertEqual(records[1]['total'], 20)
+        self.assertEqual(records[2]['message'], 'hello ${X}')
+        self.assertEqual(records[3]['status'], 'Done')
+        self.assertIn('elapsed', records[3])
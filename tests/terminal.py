@@ -0,0 +1,353 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock
+from helperlib import terminal
+from helperlib.terminal import *
+
+
+def _tty():
+    master, slave = os.openpty()
+    return master, os.fdopen(slave, 'w')
+
+
+class CapabilityCacheTestCase(TestCase):
+    def setUp(self):
+        terminal._capabilities.clear()
+        self.master, self.stream = _tty()
+        self.env = mock.patch.dict(os.environ, {'TERM': 'xterm'})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.stream.close()
+        os.close(self.master)
+        terminal._capabilities.clear()
+
+    def test_probe_once(self):
+        with mock.patch.object(terminal, '_probe', wraps=terminal._probe) as probe:
+            first = TerminalController(self.stream)
+            second = TerminalController(self.stream)
+        self.assertEqual(probe.call_count, 1)
+        self.assertEqual(first.RED, second.RED)
+        self.assertTrue(first.RED)
+
+    def test_not_a_tty(self):
+        term = TerminalController(io.StringIO())
+        self.assertEqual(term.RED, '')
+        self.assertIsNone(term.COLS)
+
+    def test_disk_cache(self):
+        if terminal._terminfo_file('xterm') is None:
+            self.skipTest('no terminfo for xterm')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.object(terminal, 'TERMINFO_CACHE', directory):
+            red = TerminalController(self.stream).RED
+            self.assertTrue(os.path.exists(os.path.join(directory, 'xterm.json')))
+            terminal._capabilities.clear()
+            with mock.patch.object(terminal, '_probe', side_effect=AssertionError):
+                self.assertEqual(TerminalController(self.stream).RED, red)
+
+
+    def test_disk_cache_file(self):
+        with mock.patch.object(terminal, 'TERMINFO_CACHE', '/cache'):
+            self.assertEqual(terminal._cache_file('xterm-256color'),
+                             '/cache/xterm-256color.json')
+            self.assertEqual(terminal._cache_file('../../etc/x'),
+                             '/cache/.._.._etc_x.json')
+
+
+class RenderTestCase(TestCase):
+    def setUp(self):
+        self.term = TerminalController(io.StringIO())
+        self.term.RED = '<red>'
+        self.term.NORMAL = '<normal>'
+
+    def test_compile_template(self):
+        self.assertEqual(compile_template('a ${RED}b$$c${NORMAL}'),
+                         ('a ', 'RED', 'b$$c', 'NORMAL', ''))
+        self.assertEqual(compile_template('plain'), ('plain',))
+
+    def test_render(self):
+        self.assertEqual(self.term.render('${RED}x${NORMAL} $$ $${RED}'),
+                         '<red>x<normal> $$ $${RED}')
+        self.assertEqual(self.term.bind('${RED}!'), '<red>!')
+        with self.assertRaises(AttributeError):
+            self.term.render('${UNKNOWN}')
+
+    def test_bind_bounded(self):
+        with mock.patch.object(terminal, '_TEMPLATE_CACHE_SIZE', 2):
+            for i in range(5):
+                self.assertEqual(self.term.bind('${RED}%d' % i), '<red>%d' % i)
+                self.assertLessEqual(len(self.term._bound), 2)
+
+
+class ControlCharsTestCase(TestCase):
+    def setUp(self):
+        self.term = TerminalController(io.StringIO())
+        self.term.RED = '\x1b[31m'
+        self.term.NORMAL = '\x1b(B\x1b[m'
+
+    def test_remove_ctrl_chars(self):
+        self.assertEqual(
+            self.term.remove_ctrl_chars('\x1b[31mred\x1b(B\x1b[m \x1b[1;32mgreen\x1b[0m'),
+            'red green')
+
+    def test_visible_width(self):
+        self.assertEqual(visible_width('abc'), 3)
+        self.assertEqual(visible_width('日本'), 4)
+        self.assertEqual(visible_width('é'), 1)
+        self.assertEqual(self.term.visible_width('\x1b[31m日\x1b(B\x1b[m'), 2)
+
+    def test_table_alignment(self):
+        out = io.StringIO()
+        Table(self.term, [['\x1b[31mred\x1b(B\x1b[m', 'a'], ['green', '日']],
+              'lr', '|').render(out)
+        self.assertEqual(self.term.remove_ctrl_chars(out.getvalue()),
+                         'red  | a\ngreen|日\n')
+
+
+class StreamingTableTestCase(TestCase):
+    def setUp(self):
+        self.term = TerminalController(io.StringIO())
+
+    def test_same_as_table(self):
+        rows = [['a', 'bb'], ['cccc', 'd'], ['x', 1, 2.5]]
+        for borders in (False, True):
+            expected = io.StringIO()
+            Table(self.term, rows, 'lcr', ' | ', borders).render(expected)
+            out = io.StringIO()
+            StreamingTable(self.term, 'lcr', ' | ', borders,
+                           stream=out).render(iter(rows))
+            self.assertEqual(out.getvalue(), expected.getvalue())
+
+    def test_sample_and_truncation(self):
+        out = io.StringIO()
+        table = StreamingTable(self.term, 'lr', max_widths=[3, None],
+                               sample=2, stream=out, buffer_size=0)
+        table.write(['abcdef', 1])
+        self.assertEqual(out.getvalue(), '')
+        table.write(['ab', 22])
+        self.assertEqual(out.getvalue(), 'ab…  1\nab  22\n')
+        table.write(['toolong', 333])
+        table.close()
+        self.assertEqual(out.getvalue().splitlines()[-1], 'to… 333')
+
+    def test_fixed_widths(self):
+        out = io.StringIO()
+        with StreamingTable(self.term, 'lr', widths=[2, 2], stream=out) as table:
+            table.write(['abc', 1])
+        self.assertEqual(out.getvalue(), 'a…  1\n')
+
+
+class TableViewTestCase(TestCase):
+    def setUp(self):
+        self.term = TerminalController(io.StringIO())
+        self.term.LINES = 5
+        self.rows = [[i, 'row%d' % (9 - i)] for i in range(10)]
+
+    def test_paging(self):
+        view = TableView(self.term, self.rows, 'rl')
+        self.assertEqual(view.page_size, 3)
+        self.assertEqual(view.page(), self.rows[:3])
+        view.handle_key(' ')
+        self.assertEqual(view.page(), self.rows[3:6])
+        view.handle_key('G')
+        self.assertEqual(view.page(), self.rows[7:])
+        view.handle_key('\x1b[B')
+        self.assertEqual(view.offset, 7)
+        view.handle_key('b')
+        view.handle_key('k')
+        self.assertEqual(view.offset, 3)
+        self.assertFalse(view.handle_key('q'))
+
+    def test_sort(self):
+        view = TableView(self.term, self.rows, 'rl')
+        view.handle_key('2')
+        self.assertEqual([r[0] for r in view.page()], [9, 8, 7])
+        view.handle_key('2')
+        self.assertTrue(view.reverse)
+        self.assertEqual([r[0] for r in view.page()], [0, 1, 2])
+        self.assertEqual(len(view._indexes), 2)
+        view.handle_key('2')
+        self.assertIs(view.order, view._indexes[(1, False)])
+
+    def test_render_page(self):
+        out = io.StringIO()
+        view = TableView(self.term, self.rows, 'rl', header=['n', 'name'],
+                         stream=out)
+        self.assertEqual(view.page_size, 2)
+        self.assertEqual(view.render_page().splitlines(), [
+            'n name', '0 row9', '1 row8',
+            ' rows 1-2 of 10 (space/b: page, 1-9: sort, q: quit) '])
+        view.draw()
+        view.handle_key(' ')
+        view.draw()
+        self.assertEqual(out.getvalue().count('row9'), 1)
+
+    def test_narrow_terminal(self):
+        self.term.COLS = 8
+        self.term.BOLD, self.term.NORMAL = '\x1b[1m', '\x1b[m'
+        rows = [[1, 'a' * 20], [2, 'b']]
+        view = TableView(self.term, rows, 'rl', header=['n', 'name'])
+        lines = view.render_page().split('\n')
+        self.assertEqual(lines[0], '\x1b[1mn name  \x1b[m')
+        self.assertEqual(lines[1], '1 aaaaaa')
+        self.assertEqual(lines[2], '2 b     ')
+        self.assertEqual(len(lines), 4)
+        for line in lines:
+            self.assertLessEqual(self.term.visible_width(line), 8)
+
+    def test_not_interactive(self):
+        out = io.StringIO()
+        view = TableView(self.term, self.rows, 'rl', stream=out,
+                         input=io.StringIO())
+        view.sort(0, reverse=True)
+        view.run()
+        self.assertEqual(out.getvalue().splitlines()[0], '9 row0')
+        self.assertEqual(len(out.getvalue().splitlines()), 10)
+
+
+class ProgressBarTestCase(TestCase):
+    def setUp(self):
+        self.out = io.StringIO()
+        self.term = TerminalController(io.StringIO())
+        self.term.BOL, self.term.UP, self.term.DOWN = '<', '^', 'v'
+        self.term.CLEAR_EOL = '~'
+        self.term.COLS = 30
+        self.clock = mock.patch.object(terminal, '_clock', return_value=0.0)
+        self.clock.start()
+
+    def tearDown(self):
+        self.clock.stop()
+
+    def test_first_frame(self):
+        ProgressBar(self.term, 'head', stream=self.out)
+        self.assertEqual(self.out.getvalue().splitlines()[-2],
+                         '<^~  0% [' + '-' * 20 + ']')
+
+    def test_throttle(self):
+        bar = ProgressBar(self.term, 'head', fps=10, stream=self.out)
+        written = len(self.out.getvalue())
+        bar.update(0.5, 'half')
+        self.assertEqual(len(self.out.getvalue()), written)
+        terminal._clock.return_value = 0.2
+        bar.update(0.5, 'half')
+        self.assertNotEqual(len(self.out.getvalue()), written)
+        terminal._clock.return_value = 0.4
+        written = len(self.out.getvalue())
+        bar.update(0.505)
+        self.assertEqual(len(self.out.getvalue()), written)
+
+    def test_diff(self):
+        bar = ProgressBar(self.term, 'head', fps=0, stream=self.out)
+        bar.update(0.5, 'msg')
+        start = len(self.out.getvalue())
+        bar.update(0.6)
+        self.assertEqual(self.out.getvalue()[start:], '<^ 60% [' + '=' * 12 + '<v')
+        start = len(self.out.getvalue())
+        bar.update(0.6, 'other')
+        self.assertEqual(self.out.getvalue()[start:], '<~' + 'other'.center(30))
+
+    def test_advance(self):
+        bar = ProgressBar(self.term, 'head', total=4, stream=self.out)
+        for _ in range(3):
+            bar.advance()
+        self.assertEqual(bar._frame[1], 0)
+        bar.advance()
+        self.assertEqual(bar._frame[1], 100)
+
+    def test_advance_without_total(self):
+        bar = ProgressBar(self.term, 'head', stream=self.out)
+        with self.assertRaises(ValueError):
+            bar.advance()
+
+    def test_update_and_advance(self):
+        bar = ProgressBar(self.term, 'head', fps=0, total=4, stream=self.out)
+        bar.update(0.5)
+        bar.draw()
+        self.assertEqual(bar._frame[1], 50)
+        bar.advance()
+        bar.draw()
+        self.assertEqual(bar._frame[1], 25)
+        bar.update(0.75)
+        bar.draw()
+        self.assertEqual(bar._frame[1], 75)
+
+    def test_slow_after_fast(self):
+        bar = ProgressBar(self.term, 'head', total=1000000, stream=self.out)
+        for _ in range(100000):
+            bar.advance()
+        for i in range(1, 4):
+            terminal._clock.return_value = float(i)
+            bar.advance(100000)
+            self.assertEqual(bar._frame[1], 10 * (i + 1))
+
+
+class ProgressManagerTestCase(TestCase):
+    def setUp(self):
+        self.out = io.StringIO()
+        self.term = TerminalController(io.StringIO())
+        self.term.BOL, self.term.UP, self.term.CLEAR_EOL = '<', '^', '~'
+        self.term.COLS = 60
+
+    def test_threads(self):
+        manager = ProgressManager(self.term, stream=self.out)
+        task = manager.add_task('work', total=40000)
+
+        def work():
+            for _ in range(10000):
+                task.advance()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(task.done, 40000)
+        self.assertEqual(len(task._slots), 4)
+
+    def test_remote(self):
+        manager = ProgressManager(self.term, stream=self.out)
+        task = manager.add_task('child')
+        remote = manager.remote(task, interval=10)
+        for _ in range(5):
+            remote.advance(2)
+        remote.close()
+        for _ in range(100):
+            manager._collect()
+            if task.done == 10:
+                break
+            time.sleep(0.01)
+        self.assertEqual(task.done, 10)
+
+    def test_rate_and_render(self):
+        manager = ProgressManager(self.term, window=2, stream=self.out)
+        task = manager.add_task('download', total=100)
+        manager.add_task('other')
+        with mock.patch.object(terminal, '_clock') as clock:
+            for now in range(4):
+                clock.return_value = float(now)
+                task.advance(10)
+                manager._collect()
+        self.assertEqual(len(task.samples), 3)
+        self.assertEqual(task.rate, 10.0)
+        self.assertEqual(task.eta, 6.0)
+        manager.draw()
+        manager.draw()
+        lines = self.out.getvalue().split('\n')
+        self.assertTrue(lines[0].startswith('<download  40% ['))
+        self.assertTrue(lines[0].endswith('] 40/100 10.0/s ETA 0:00:06~'))
+        self.assertEqual(len(lines[0]) - 2, 60)
+        self.assertTrue(lines[1].startswith('other      0% ['))
+        self.assertTrue(lines[2].startswith('<^^download'))
+
+    def test_not_capable(self):
+        term = TerminalController(io.StringIO())
+        with ProgressManager(term, stream=self.out) as manager:
+            manager.add_task('a', total=2).advance(2)
+        self.assertTrue(self.out.getvalue().startswith('a 100% [=='))